@@ -2,72 +2,55 @@
 
 import os
 import re
-import cv2
+import numpy as np
 import pandas as pd
 import hashlib
 import shutil
+from hash_cache import HashCache
+from checksum_manifest import ChecksumManifest, find_manifest
+from checksum_client import verify_checksums, CHECKSUM_SERVER_ENV
+from barcode_registry import open_registry
+from barcode_index import BarcodeIndex, load_barcode_index
+from qc_metrics import read_image, measure_image, is_white_balanced, is_in_focus
 
 def is_valid_filename(filename):
     """Check if the filename matches the valid barcode format."""
     pattern = r'^(V\d{7}F|C\d{7}F)\.(jpg|jpeg|dng)$'
     return re.match(pattern, filename, re.IGNORECASE) is not None
 
-def calculate_checksum(file_path):
-    """Calculate the MD5 checksum of the file."""
+def calculate_checksum(file_path, cache=None):
+    """Calculate the MD5 checksum of the file, reusing the cached checksum if the file is unchanged."""
+    if cache is not None:
+        return cache.get_md5(file_path, calculate_checksum)
     hasher = hashlib.md5()
     with open(file_path, 'rb') as f:
         while chunk := f.read(8192):
             hasher.update(chunk)
     return hasher.hexdigest()
 
-def check_white_balance(image):
-    """Calculate the average RGB values of the image."""
-    img_float = image.astype(np.float32) / 255.0
-    return img_float.mean(axis=(0, 1))
-
-def is_white_balanced(means, threshold=0.1):
-    """Check if the image is white balanced based on the average RGB values."""
-    return abs(means[0] - means[1]) < threshold and abs(means[1] - means[2]) < threshold
-
-def check_focus(image):
-    """Calculate the focus measure of the image."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    return cv2.Laplacian(gray, cv2.CV_64F).var()
-
-def is_in_focus(focus_measure, focus_threshold=100.0):
-    """Check if the image is in focus based on the focus measure."""
-    return focus_measure > focus_threshold
-
-def load_completed_barcodes(file_path):
-    """Load processed barcodes from a text file."""
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as f:
-            return set(f.read().strip().splitlines())
-    return set()
-
-def save_completed_barcodes(file_path, barcodes):
-    """Save the set of completed barcodes to a text file."""
-    with open(file_path, 'w') as f:
-        for barcode in barcodes:
-            f.write(f"{barcode}\n")
-
 def load_barcode_list(file_path='valid_barcodes.txt'):
-    """Load valid barcodes from a text file in the script's directory."""
+    """Load valid barcodes from a text file in the script's directory, through its memory mapped index."""
     script_dir = os.path.dirname(os.path.abspath(__file__))  # Get the directory of the script
     full_path = os.path.join(script_dir, file_path)  # Construct the full path
     if os.path.exists(full_path):
-        with open(full_path, 'r') as f:
-            return set(f.read().strip().splitlines())
+        return load_barcode_index(full_path)  # Rebuilt automatically when the text file changes
     else:
         print(f"Warning: {full_path} not found. Returning an empty set.")
-        return set()
+        return BarcodeIndex(np.empty(0, dtype=np.uint32))
+
+def check_checksums_with_server(checksums, manifest=None, server_url=None):
+    """Verify {filename: checksum} with the Picturae server in batched requests, or against their manifest.
 
-def check_checksum_with_server(filename, checksum):
-    """Placeholder function for checksum verification with the Picturae server."""
-    # Implement actual server checking logic here
-    return True  # For testing, assume all checksums are valid
+    Returns {filename: True/False/None}, None where the server or manifest does not know the file.
+    """
+    if server_url:
+        return verify_checksums(server_url, checksums)
+    if manifest is not None:
+        return {filename: manifest.verify(filename, checksum) for filename, checksum in checksums.items()}
+    return dict.fromkeys(checksums, True)  # Nothing to verify against, assume all checksums are valid
 
-def process_images(folder_path, completed_barcodes, barcode_list, error_folder):
+def process_images(folder_path, completed_barcodes, barcode_list, error_folder, cache=None, manifest=None,
+                   server_url=None):
     """Process images for QC checks and log results."""
     results = []
     errors = []
@@ -75,16 +58,30 @@ def process_images(folder_path, completed_barcodes, barcode_list, error_folder):
     # Create error folder if it doesn't exist
     os.makedirs(error_folder, exist_ok=True)
 
-    for filename in os.listdir(folder_path):
+    # Checksum every valid file first so they can be verified with Picturae in a few batched requests
+    filenames = os.listdir(folder_path)
+    checksums = {filename: calculate_checksum(os.path.join(folder_path, filename), cache)
+                 for filename in filenames if is_valid_filename(filename)}
+    verified_checksums = check_checksums_with_server(checksums, manifest, server_url)
+
+    # Look up every barcode in the listing against the valid barcode list in one vectorised call
+    barcodes = [filename.split('.')[0] for filename in checksums]
+    valid_barcodes = dict(zip(barcodes, barcode_list.contains_many(barcodes)))
+
+    for filename in filenames:
         if not is_valid_filename(filename):
             errors.append((filename, "Invalid filename format"))
             continue
         
         file_path = os.path.join(folder_path, filename)
-        checksum = calculate_checksum(file_path)
+        checksum = checksums[filename]
 
         # Check checksum with Picturae server
-        if not check_checksum_with_server(filename, checksum):
+        verified = verified_checksums[filename]
+        if verified is None:
+            errors.append((filename, "Checksum not known to Picturae"))
+            continue
+        if not verified:
             errors.append((filename, "Checksum mismatch"))
             continue
         
@@ -97,24 +94,23 @@ def process_images(folder_path, completed_barcodes, barcode_list, error_folder):
             errors.append((filename, "Barcode already processed - moved to error folder"))
             continue
         
-        if barcode not in barcode_list:
+        if not valid_barcodes[barcode]:
             errors.append((filename, "Invalid barcode"))
             continue
 
-        image = cv2.imread(file_path)
+        image = read_image(file_path)  # Raw files are measured on their embedded preview
         if image is None:
             errors.append((filename, "Image could not be read"))
             continue
 
-        # Check white balance
-        white_balance = check_white_balance(image)
-        if not is_white_balanced(white_balance):
+        # White balance and focus from one pass over the decoded image
+        metrics = measure_image(image)
+        if not is_white_balanced(metrics.means):
             errors.append((filename, "Not white balanced"))
             continue
 
         # Check focus
-        focus_measure = check_focus(image)
-        if not is_in_focus(focus_measure):
+        if not is_in_focus(metrics.focus):
             errors.append((filename, "Out of focus"))
             continue
 
@@ -127,8 +123,8 @@ def process_images(folder_path, completed_barcodes, barcode_list, error_folder):
             'In Focus': True
         })
         
-        # Add barcode to completed list
-        completed_barcodes.add(barcode)
+        # Add barcode to the completed registry, committed in batches as the run goes
+        completed_barcodes.add(barcode, filename, checksum)
 
     # Save results and errors to CSV
     if results:
@@ -136,13 +132,19 @@ def process_images(folder_path, completed_barcodes, barcode_list, error_folder):
     if errors:
         pd.DataFrame(errors, columns=['Filename', 'Error']).to_csv(os.path.join(folder_path, 'error_log.csv'), index=False)
 
-    # Update the completed barcodes file
-    save_completed_barcodes(os.path.join(folder_path, 'completed_barcodes.txt'), completed_barcodes)
+    # Commit the last batch of completed barcodes
+    completed_barcodes.commit()
 
 if __name__ == "__main__":
     folder_path = input("Enter the folder path containing images: ")
     barcode_list = load_barcode_list()  # Now loads from the same directory as the script
-    completed_barcodes = load_completed_barcodes(os.path.join(folder_path, 'completed_barcodes.txt'))
+    completed_barcodes = open_registry(folder_path)  # SQLite registry, imports completed_barcodes.txt the first time
     error_folder = os.path.join(folder_path, 'error_files')  # Define the error folder
-    process_images(folder_path, completed_barcodes, barcode_list, error_folder)
+    cache = HashCache()  # Checksums of unchanged files are reused between runs
+    manifest_path = find_manifest(folder_path)  # Checksums delivered by Picturae with the images
+    manifest = ChecksumManifest(manifest_path) if manifest_path else None
+    server_url = os.environ.get(CHECKSUM_SERVER_ENV)  # Picturae checksum server, used instead of the manifest if set
+    process_images(folder_path, completed_barcodes, barcode_list, error_folder, cache, manifest, server_url)
+    cache.save()
+    completed_barcodes.close()
     print("QC process completed.")
@@ -0,0 +1,90 @@
+### Compact index of valid barcodes.
+### Barcodes are [VC]\d{7}F, so each one maps to an integer below 2 * 10^7 (C adds 10^7) and the whole list is one
+### sorted uint32 array: 4 bytes per barcode instead of a 70+ byte Python string in a set. The array is saved as
+### .npy next to valid_barcodes.txt and memory mapped, so loading costs nothing and pages are only touched by
+### lookups. A whole directory listing is checked at once with np.searchsorted.
+
+import os
+import re
+import argparse
+import numpy as np
+
+BARCODE_PATTERN = re.compile(r'^([VC])(\d{7})F$')
+PREFIX_OFFSETS = {'V': 0, 'C': 10_000_000}
+
+def encode_barcode(barcode):
+    """Return the integer code of a barcode (case insensitive), or -1 if it is not a [VC]\\d{7}F barcode."""
+    match = BARCODE_PATTERN.match(barcode.strip().upper())
+    if match is None:
+        return -1
+    return PREFIX_OFFSETS[match.group(1)] + int(match.group(2))
+
+def encode_barcodes(barcodes):
+    """Return an int64 array of codes, -1 where a barcode does not fit the pattern."""
+    return np.fromiter((encode_barcode(barcode) for barcode in barcodes), dtype=np.int64)
+
+def index_path_for(text_path):
+    """valid_barcodes.txt -> valid_barcodes.npy"""
+    return os.path.splitext(text_path)[0] + '.npy'
+
+def build_index(text_path, index_path=None):
+    """Build the sorted code array from a barcode text file, one barcode per line. Returns (index path, skipped)."""
+    if index_path is None:
+        index_path = index_path_for(text_path)
+    with open(text_path, 'r') as f:
+        codes = encode_barcodes(f)
+    skipped = int(np.count_nonzero(codes < 0))
+    codes = np.unique(codes[codes >= 0]).astype(np.uint32)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, codes)
+    os.replace(tmp_path, index_path)
+    return index_path, skipped
+
+class BarcodeIndex:
+    """Set-like view of valid barcodes over a sorted uint32 array."""
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    @classmethod
+    def load(cls, index_path):
+        """Memory map a prebuilt index."""
+        return cls(np.load(index_path, mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, barcode):
+        return bool(self.contains_many([barcode])[0])
+
+    def contains_many(self, barcodes):
+        """Return a bool array saying which of the barcodes are in the index."""
+        codes = encode_barcodes(barcodes)
+        found = np.zeros(len(codes), dtype=bool)
+        valid = codes >= 0
+        if len(self.codes) == 0 or not valid.any():
+            return found
+        # Query in the index's own dtype: a wider query would make NumPy convert the whole memory map
+        query = codes[valid].astype(self.codes.dtype)
+        positions = np.searchsorted(self.codes, query).clip(max=len(self.codes) - 1)
+        found[valid] = self.codes[positions] == query
+        return found
+
+def load_barcode_index(text_path):
+    """Load the index for a barcode text file, rebuilding it first if the text file is newer."""
+    index_path = index_path_for(text_path)
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(text_path):
+        index_path, skipped = build_index(text_path, index_path)
+        if skipped:
+            print(f"Warning: skipped {skipped} lines in {text_path} that are not [VC]nnnnnnnF barcodes.")
+    return BarcodeIndex.load(index_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the compact index for a valid barcode list.")
+    parser.add_argument('text_path', help="Barcode list, one barcode per line")
+    parser.add_argument('--output', help="Index file (defaults to the text file name with .npy)")
+    args = parser.parse_args()
+
+    index_path, skipped = build_index(args.text_path, args.output)
+    print(f"Wrote {len(BarcodeIndex.load(index_path))} barcodes to {index_path}, skipped {skipped} lines")
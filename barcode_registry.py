@@ -0,0 +1,118 @@
+### Completed barcode registry.
+### Replaces completed_barcodes.txt with an SQLite database in WAL mode: barcodes are the primary key, so membership
+### is an index lookup instead of loading a million lines into a set, and completions are committed in batches as
+### the run goes, so a crash loses at most one batch. WAL lets checks read while another run writes, and the busy
+### timeout makes concurrent runs wait their turn instead of overwriting each other's file.
+
+import os
+import time
+import sqlite3
+import argparse
+
+DEFAULT_REGISTRY_NAME = 'completed_barcodes.db'
+DEFAULT_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completed (
+    barcode TEXT PRIMARY KEY,
+    filename TEXT,
+    checksum TEXT,
+    completed_at REAL NOT NULL,
+    run_id TEXT
+) WITHOUT ROWID
+"""
+
+def new_run_id():
+    """Return an id for this run, unique across the machines sharing a registry in practice."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+class BarcodeRegistry:
+    """Barcodes that have completed QC, with when, the file and checksum, and which run completed them.
+
+    add() queues completions and commits them every batch_size; the first run to commit a barcode keeps it.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, run_id=None, timeout=30.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.run_id = run_id or new_run_id()
+        self.pending = {}
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def __contains__(self, barcode):
+        if barcode in self.pending:
+            return True
+        return self.connection.execute('SELECT 1 FROM completed WHERE barcode = ?', (barcode,)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM completed').fetchone()[0] + len(self.pending)
+
+    def add(self, barcode, filename=None, checksum=None):
+        """Record a completed barcode; committed with the rest of its batch."""
+        self.pending.setdefault(barcode, (barcode, filename, checksum, time.time(), self.run_id))
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        """Write queued completions in one transaction."""
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO completed VALUES (?, ?, ?, ?, ?)',
+                                        self.pending.values())
+        self.pending = {}
+
+    def get(self, barcode):
+        """Return (filename, checksum, completed_at, run_id) for a completed barcode, or None."""
+        self.commit()
+        return self.connection.execute('SELECT filename, checksum, completed_at, run_id FROM completed '
+                                       'WHERE barcode = ?', (barcode,)).fetchone()
+
+    def import_text(self, file_path):
+        """Import barcodes from an old completed_barcodes.txt, one per line. Returns the number of new barcodes."""
+        before = len(self)
+        with open(file_path, 'r') as f:
+            for line in f:
+                barcode = line.strip()
+                if barcode:
+                    self.add(barcode)
+        self.commit()
+        return len(self) - before
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def open_registry(folder_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Open the registry in a folder, importing its completed_barcodes.txt the first time."""
+    path = os.path.join(folder_path, DEFAULT_REGISTRY_NAME)
+    is_new = not os.path.exists(path)
+    registry = BarcodeRegistry(path, batch_size)
+    text_path = os.path.join(folder_path, 'completed_barcodes.txt')
+    if is_new and os.path.exists(text_path):
+        print(f"Imported {registry.import_text(text_path)} barcodes from {text_path}")
+    return registry
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect or import into a completed barcode registry.")
+    parser.add_argument('registry', help="Registry database file")
+    parser.add_argument('--import', dest='import_path', metavar='TXT', help="Import barcodes from a text file")
+    parser.add_argument('--check', nargs='+', metavar='BARCODE', help="Show whether barcodes are completed")
+    args = parser.parse_args()
+
+    with BarcodeRegistry(args.registry) as registry:
+        if args.import_path:
+            print(f"Imported {registry.import_text(args.import_path)} barcodes")
+        for barcode in args.check or ():
+            print(f"{barcode}: {registry.get(barcode) or 'not completed'}")
+        print(f"{len(registry)} completed barcodes")
@@ -0,0 +1,110 @@
+### Calibrates the focus and white balance thresholds for reduced resolution QC.
+### Each sample image is measured at full resolution and at each reduced scale. For every scale the threshold that
+### best reproduces the full resolution pass/fail decisions (focus_threshold=100.0, WB threshold=0.1) is saved to
+### qc_calibration.json, which qc_metrics.load_thresholds reads.
+
+import os
+import json
+import argparse
+import statistics
+from qc_metrics import (read_image, check_white_balance, check_focus, CALIBRATION_PATH,
+                        DEFAULT_FOCUS_THRESHOLD, DEFAULT_WB_THRESHOLD, REDUCED_DECODE_FLAGS)
+
+def wb_difference(means):
+    """Largest neighbouring channel difference, the value is_white_balanced compares to its threshold."""
+    return max(abs(means[0] - means[1]), abs(means[1] - means[2]))
+
+def measure_image(file_path, scale):
+    """Return (focus measure, white balance difference) for an image decoded at the given scale."""
+    image = read_image(file_path, scale)
+    if image is None:
+        return None
+    return float(check_focus(image)), float(wb_difference(check_white_balance(image)))
+
+def fit_threshold(full_values, reduced_values, full_threshold, passes_above):
+    """Find the reduced scale threshold that agrees most often with the full resolution decisions.
+
+    Candidates are the midpoints between measured reduced values plus the threshold scaled by the median
+    reduced/full ratio; ties go to the candidate closest to that ratio estimate.
+    Returns (threshold, fraction of samples that agree).
+    """
+    ratios = [r / f for f, r in zip(full_values, reduced_values) if f > 0]
+    estimate = full_threshold * statistics.median(ratios) if ratios else full_threshold
+
+    labels = [(f > full_threshold) if passes_above else (f < full_threshold) for f in full_values]
+    ordered = sorted(set(reduced_values))
+    candidates = [estimate] + [(a + b) / 2 for a, b in zip(ordered, ordered[1:])]
+
+    def agreement(threshold):
+        decisions = [(r > threshold) if passes_above else (r < threshold) for r in reduced_values]
+        return sum(d == label for d, label in zip(decisions, labels))
+
+    best = max(candidates, key=lambda t: (agreement(t), -abs(t - estimate)))
+    return best, agreement(best) / len(labels)
+
+def calibrate(sample_dir, scales, limit=None, focus_threshold=DEFAULT_FOCUS_THRESHOLD, wb_threshold=DEFAULT_WB_THRESHOLD):
+    """Measure the sample images and return the calibration entry for each scale."""
+    valid_extensions = ('.jpg', '.jpeg', '.tif', '.tiff', '.dng', '.cr2')
+    file_paths = [os.path.join(sample_dir, f) for f in sorted(os.listdir(sample_dir)) if f.lower().endswith(valid_extensions)]
+    if limit:
+        file_paths = file_paths[:limit]
+
+    full = {}
+    for file_path in file_paths:
+        measures = measure_image(file_path, 1)
+        if measures is not None:
+            full[file_path] = measures
+    if not full:
+        raise ValueError(f"No readable sample images in {sample_dir}")
+
+    calibration = {}
+    for scale in scales:
+        reduced = {file_path: measure_image(file_path, scale) for file_path in full}
+        paths = [file_path for file_path in full if reduced[file_path] is not None]
+        if not paths:
+            print(f"Warning: no sample images could be decoded at 1/{scale}. Skipping.")
+            continue
+        focus_fit, focus_agreement = fit_threshold([full[p][0] for p in paths], [reduced[p][0] for p in paths],
+                                                   focus_threshold, passes_above=True)
+        wb_fit, wb_agreement = fit_threshold([full[p][1] for p in paths], [reduced[p][1] for p in paths],
+                                             wb_threshold, passes_above=False)
+        calibration[str(scale)] = {
+            'focus_threshold': focus_fit,
+            'wb_threshold': wb_fit,
+            'focus_agreement': focus_agreement,
+            'wb_agreement': wb_agreement,
+            'samples': len(paths),
+            'full_focus_threshold': focus_threshold,
+            'full_wb_threshold': wb_threshold,
+        }
+    return calibration
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate QC thresholds for reduced resolution decoding.")
+    parser.add_argument('sample_dir', help="Folder of representative images, ideally with known good and bad examples")
+    parser.add_argument('--scales', type=int, nargs='+', choices=[s for s in REDUCED_DECODE_FLAGS if s > 1], default=[2, 4, 8])
+    parser.add_argument('--limit', type=int, help="Only use the first N images")
+    parser.add_argument('--output', default=CALIBRATION_PATH)
+    args = parser.parse_args()
+
+    calibration = {}
+    if os.path.exists(args.output):
+        with open(args.output, 'r') as f:
+            calibration = json.load(f)
+    calibration.update(calibrate(args.sample_dir, args.scales, args.limit))
+    tmp_path = args.output + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(tmp_path, args.output)
+
+    for scale in args.scales:
+        if str(scale) not in calibration:
+            continue
+        entry = calibration[str(scale)]
+        print(f"1/{scale}: focus_threshold={entry['focus_threshold']:.2f} ({entry['focus_agreement']:.1%} agreement), "
+              f"wb_threshold={entry['wb_threshold']:.4f} ({entry['wb_agreement']:.1%} agreement), "
+              f"{entry['samples']} samples")
+    print(f"Calibration saved to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+### Batched checksum verification against the Picturae checksum server.
+### Checksums are sent hundreds at a time as JSON over a small pool of keep-alive HTTP/1.1 connections, with a cap
+### on requests in flight and retries with backoff, so a day of 10k images costs a few dozen round trips instead of
+### one per image. Built on asyncio streams so it needs nothing outside the standard library.
+###
+### Protocol: POST <url> with {"checksums": {filename: md5}} returns {"results": {filename: true | false | null}},
+### null meaning the server has no checksum for that file. checksum_server.py is a local stand-in.
+
+import ssl
+import json
+import asyncio
+from urllib.parse import urlsplit
+
+CHECKSUM_SERVER_ENV = 'PICTURAE_CHECKSUM_URL'  # Environment variable holding the server URL
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CONNECTIONS = 4
+DEFAULT_RETRIES = 3
+
+class ChecksumServerError(Exception):
+    """The checksum server rejected a request or could not be reached after retrying."""
+
+class ChecksumClient:
+    """asyncio client that verifies {filename: md5} in batches over pooled keep-alive connections.
+
+    connections caps both the pool size and the number of batches in flight.
+    """
+
+    def __init__(self, url, batch_size=DEFAULT_BATCH_SIZE, connections=DEFAULT_CONNECTIONS, retries=DEFAULT_RETRIES,
+                 timeout=30.0, backoff=0.5):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')  # Request target, query included
+        self.batch_size = batch_size
+        self.connections = max(1, connections)
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.requests_sent = 0
+        self._pool = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _slots(self):
+        # Each slot holds an open (reader, writer) pair or None; taking a slot is what limits concurrency
+        if self._pool is None:
+            self._pool = asyncio.LifoQueue()
+            for _ in range(self.connections):
+                self._pool.put_nowait(None)
+        return self._pool
+
+    async def _request(self, connection, body):
+        if connection is None or connection[1].is_closing():
+            connection = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        reader, writer = connection
+        try:
+            writer.write((f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed by server")
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if 'content-length' not in headers:
+                raise ChecksumServerError("Response without Content-Length is not supported")
+            payload = await reader.readexactly(int(headers['content-length']))
+        except BaseException:
+            # Failed, timed out or cancelled part way through the exchange: the connection is out of step with the
+            # server, and one opened above is not known to the caller, so close it here
+            writer.close()
+            raise
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+            connection = None
+        return connection, status, payload
+
+    async def _post(self, payload):
+        body = json.dumps(payload).encode()
+        pool = self._slots()
+        connection = await pool.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    connection, status, response = await asyncio.wait_for(self._request(connection, body),
+                                                                          self.timeout)
+                    self.requests_sent += 1
+                    if status < 500:
+                        if status != 200:
+                            raise ChecksumServerError(f"Checksum server returned HTTP {status}")
+                        return json.loads(response)['results']
+                    error = ChecksumServerError(f"Checksum server returned HTTP {status}")
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                    error = e
+                    if connection is not None:
+                        connection[1].close()
+                    connection = None  # Reconnect on the next attempt
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+            raise ChecksumServerError(f"Checksum request failed after {self.retries + 1} attempts: {error}")
+        finally:
+            pool.put_nowait(connection)
+
+    async def verify_many(self, checksums):
+        """Return {filename: True/False/None} for {filename: md5}, None where the server does not know the file."""
+        items = list(checksums.items())
+        batches = [dict(items[i:i + self.batch_size]) for i in range(0, len(items), self.batch_size)]
+        results = {}
+        for batch_results in await asyncio.gather(*(self._post({'checksums': batch}) for batch in batches)):
+            results.update(batch_results)
+        return {filename: results.get(filename) for filename in checksums}
+
+    async def close(self):
+        """Close the pooled connections."""
+        if self._pool is None:
+            return
+        while not self._pool.empty():
+            connection = self._pool.get_nowait()
+            if connection is not None:
+                connection[1].close()
+                await connection[1].wait_closed()
+        self._pool = None
+
+def verify_checksums(url, checksums, **options):
+    """Blocking wrapper for the scripts: verify {filename: md5} against the server at url."""
+    async def run():
+        async with ChecksumClient(url, **options) as client:
+            return await client.verify_many(checksums)
+    return asyncio.run(run())
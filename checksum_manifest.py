@@ -0,0 +1,153 @@
+### Vendor checksum manifests.
+### Picturae can supply the MD5 of every delivered file as a CSV, JSON or BagIt style manifest-md5.txt. The manifest
+### is loaded once into a {filename: md5} index and Alliance files are verified against it, so the Picturae copies
+### never have to be read. --build writes a manifest for a local directory as a stand-in for the vendor's.
+
+import os
+import csv
+import json
+import argparse
+from hash_engine import HashEngine
+
+# Manifest names looked for in a delivery folder, in order
+MANIFEST_NAMES = ('manifest-md5.txt', 'manifest.csv', 'manifest.json')
+FILENAME_COLUMNS = ('filename', 'file', 'name', 'path')
+MD5_COLUMNS = ('md5', 'md5 hash', 'checksum', 'hash')
+
+def _basename(path):
+    """Manifests may list paths (data/V0507989F.jpg, Windows separators); files are matched on their name."""
+    return os.path.basename(path.strip().replace('\\', '/'))
+
+def _pick(row, names):
+    columns = {str(key).strip().lower(): key for key in row}
+    for name in names:
+        if name in columns:
+            return row[columns[name]]
+    raise ValueError(f"Manifest has no column named any of {', '.join(names)}")
+
+def _read_bagit(f):
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            digest, path = line.split(None, 1)
+            yield path, digest
+
+def _read_csv(f):
+    for row in csv.DictReader(f):
+        yield _pick(row, FILENAME_COLUMNS), _pick(row, MD5_COLUMNS)
+
+def _read_json(f):
+    data = json.load(f)
+    if isinstance(data, dict):
+        yield from data.items()
+    else:
+        for row in data:
+            yield _pick(row, FILENAME_COLUMNS), _pick(row, MD5_COLUMNS)
+
+def _reader(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {'.csv': _read_csv, '.json': _read_json}.get(extension, _read_bagit)
+
+class ChecksumManifest:
+    """{filename: md5} index of a vendor manifest.
+
+    Names listed twice with different digests are left out of the index and kept in conflicts, so those files fall
+    back to being hashed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hashes = {}
+        self.conflicts = set()
+        if path is not None:
+            self.load(path)
+
+    def load(self, path):
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            for name, digest in _reader(path)(f):
+                name, digest = _basename(name), digest.strip().lower()
+                if name in self.conflicts:
+                    continue
+                if self.hashes.get(name, digest) != digest:
+                    del self.hashes[name]
+                    self.conflicts.add(name)
+                    continue
+                self.hashes[name] = digest
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, filename):
+        return filename in self.hashes
+
+    def get(self, filename):
+        return self.hashes.get(filename)
+
+    def known_for(self, filenames):
+        """Return {filename: md5} for the given filenames that the manifest covers."""
+        return {filename: self.hashes[filename] for filename in filenames if filename in self.hashes}
+
+    def verify(self, filename, md5):
+        """Return True/False if the file's MD5 matches the manifest, or None if the manifest does not list it."""
+        expected = self.hashes.get(filename)
+        return None if expected is None else expected == md5.lower()
+
+def find_manifest(directory):
+    """Return the path of the manifest delivered in a directory, or None."""
+    for name in MANIFEST_NAMES:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def build_manifest(directory, output, file_filter=None, engine=None):
+    """Write a manifest of every file in a directory, in the format given by the output extension."""
+    if engine is None:
+        engine = HashEngine()
+    names = sorted(f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))
+                   and f not in MANIFEST_NAMES and (file_filter is None or file_filter(f)))
+    paths = {f: os.path.join(directory, f) for f in names}
+    hashes = engine.md5_many(list(paths.values()))
+    extension = os.path.splitext(output)[1].lower()
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        if extension == '.json':
+            json.dump({name: hashes[paths[name]] for name in names}, f, indent=2)
+        elif extension == '.csv':
+            writer = csv.writer(f)
+            writer.writerow(['Filename', 'MD5'])
+            writer.writerows([name, hashes[paths[name]]] for name in names)
+        else:
+            f.writelines(f"{hashes[paths[name]]}  data/{name}\n" for name in names)
+    os.replace(tmp_path, output)
+    return len(names)
+
+def verify_directory(manifest, directory, engine=None):
+    """Hash every file the manifest lists that is present in directory and return (matched, mismatched, missing)."""
+    if engine is None:
+        engine = HashEngine()
+    present = {f for f in os.listdir(directory) if f in manifest}
+    hashes = engine.md5_many([os.path.join(directory, f) for f in sorted(present)])
+    mismatched = sorted(f for f in present if not manifest.verify(f, hashes[os.path.join(directory, f)]))
+    missing = sorted(f for f in manifest.hashes if f not in present)
+    return len(present) - len(mismatched), mismatched, missing
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build or check a checksum manifest (CSV, JSON or BagIt manifest-md5.txt).")
+    parser.add_argument('manifest', help="Manifest file; the format follows the extension (.csv, .json, otherwise BagIt)")
+    parser.add_argument('--build', metavar='DIR', help="Write a manifest of DIR, as a stand-in for the vendor's")
+    parser.add_argument('--verify', metavar='DIR', help="Check the files in DIR against the manifest")
+    args = parser.parse_args()
+
+    if args.build:
+        print(f"Wrote {build_manifest(args.build, args.manifest)} entries to {args.manifest}")
+    if args.verify:
+        manifest = ChecksumManifest(args.manifest)
+        matched, mismatched, missing = verify_directory(manifest, args.verify)
+        print(f"{matched} files match the manifest, {len(mismatched)} do not, {len(missing)} listed files are missing")
+        for filename in mismatched:
+            print(f"[MISMATCH] {filename}")
+        for filename in missing:
+            print(f"[MISSING] {filename}")
+        for filename in sorted(manifest.conflicts):
+            print(f"[CONFLICT] {filename} is listed with different checksums")
@@ -0,0 +1,57 @@
+### Local stand-in for the Picturae checksum server.
+### Serves the batched protocol checksum_client.py speaks from a checksum manifest, with keep-alive connections,
+### so the client can be tested without the vendor. Not meant to face the network.
+
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from checksum_manifest import ChecksumManifest
+
+class ChecksumRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections open between requests
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            checksums = json.loads(self.rfile.read(length))['checksums']
+        except (ValueError, KeyError):
+            self._send(400, {'error': 'Expected {"checksums": {filename: md5}}'})
+            return
+        manifest = self.server.manifest
+        self._send(200, {'results': {filename: manifest.verify(filename, md5) for filename, md5 in checksums.items()}})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per batch is noise
+
+def make_server(manifest, host='127.0.0.1', port=0):
+    """Return a server answering from manifest; port 0 picks a free port (see server.server_address)."""
+    server = ThreadingHTTPServer((host, port), ChecksumRequestHandler)
+    server.daemon_threads = True
+    server.manifest = manifest
+    return server
+
+def start_server(manifest, host='127.0.0.1', port=0):
+    """Serve in a background thread and return (server, url). Call server.shutdown() when done."""
+    server = make_server(manifest, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/checksums"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve checksum verification from a manifest (local stand-in).")
+    parser.add_argument('manifest', help="Manifest file (CSV, JSON or BagIt manifest-md5.txt)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    server = make_server(ChecksumManifest(args.manifest), args.host, args.port)
+    print(f"Serving {len(server.manifest)} checksums on http://{args.host}:{args.port}/checksums")
+    server.serve_forever()
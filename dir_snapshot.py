@@ -0,0 +1,59 @@
+### Directory snapshots.
+### Each directory is listed once per run with os.scandir, recording size, mtime, inode and whether each entry is a
+### file. Stages share the snapshot and update it in place as they copy or move files, instead of re-listing the
+### directory (seconds per listing on the SMB shares) or calling os.path.exists/isfile for every file.
+
+import os
+from collections import namedtuple
+
+FileEntry = namedtuple('FileEntry', ['size', 'mtime_ns', 'ino', 'is_file'])
+
+class DirectorySnapshot:
+    """{filename: FileEntry} for one directory, taken once and kept up to date by the code that changes it."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-list the directory from scratch."""
+        self.entries = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    self.entries[entry.name] = FileEntry(st.st_size, st.st_mtime_ns, entry.inode(), True)
+                else:
+                    self.entries[entry.name] = FileEntry(0, 0, entry.inode(), False)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def is_file(self, name):
+        entry = self.entries.get(name)
+        return entry is not None and entry.is_file
+
+    def files(self, file_filter=None):
+        """Return the names of the files in the snapshot, optionally only those file_filter accepts."""
+        return [name for name, entry in self.entries.items()
+                if entry.is_file and (file_filter is None or file_filter(name))]
+
+    def signatures(self, file_filter=None):
+        """Return {filename: [size, mtime_ns]} for the files in the snapshot."""
+        return {name: [self.entries[name].size, self.entries[name].mtime_ns] for name in self.files(file_filter)}
+
+    def add(self, name):
+        """Record a file that was copied or moved into the directory."""
+        st = os.stat(self.path(name))
+        self.entries[name] = FileEntry(st.st_size, st.st_mtime_ns, st.st_ino, True)
+
+    def remove(self, name):
+        """Record that a file was moved out of the directory."""
+        self.entries.pop(name, None)
@@ -0,0 +1,163 @@
+### Journaled batch file mover for routing files into the error folders.
+### The QC stages only plan their moves while they scan; execute() then carries them out in one batch, creating
+### each error folder the first time something goes into it. Moves are os.replace renames on the same filesystem.
+### Across devices the file is cloned (reflink) or copied in the kernel with copy_file_range where available,
+### then the source is removed. The plan is written to a journal first and each finished move is recorded, so a
+### run interrupted part way can be rolled forward or back with recover().
+
+import os
+import sys
+import json
+import errno
+import shutil
+import argparse
+
+MOVE_JOURNAL_NAME = '.move_journal.jsonl'
+FICLONE = 0x40049409  # Linux ioctl to share extents between files on btrfs/XFS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+def journal_path_for(directory):
+    """Return the move journal path for a directory the moves are made in."""
+    return os.path.join(directory, MOVE_JOURNAL_NAME)
+
+def _copy_across(src, dst):
+    """Copy src to dst on another filesystem: reflink, then copy_file_range, then a plain copy."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 8 * 1024 * 1024)
+
+def move_file(src, dst):
+    """Move a file, replacing dst. Falls back to copy and delete when src and dst are on different devices."""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        part_path = dst + '.part'
+        _copy_across(src, part_path)
+        shutil.copystat(src, part_path)
+        os.replace(part_path, dst)
+        os.unlink(src)
+
+class MovePlan:
+    """Moves collected during a scan and executed together, journaled to journal_path."""
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.moves = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, src, dst):
+        """Plan a move of src to dst. Nothing touches the filesystem until execute()."""
+        self.moves.append((src, dst))
+
+    def execute(self):
+        """Carry out the planned moves. Returns [(src, dst, error)] for moves that failed; the rest are done."""
+        if not self.moves:
+            return []
+        if os.path.exists(self.journal_path):
+            # An earlier batch never finished; complete it before its journal is replaced
+            print(f"Completed {recover(self.journal_path)} moves left over from an interrupted run")
+        with open(self.journal_path, 'w') as journal:
+            journal.write(json.dumps({'moves': self.moves}) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+            failures = []
+            created = set()
+            for index, (src, dst) in enumerate(self.moves):
+                folder = os.path.dirname(dst)
+                try:
+                    if folder not in created:
+                        os.makedirs(folder, exist_ok=True)
+                        created.add(folder)
+                    move_file(src, dst)
+                except OSError as e:
+                    failures.append((src, dst, e))
+                    print(f"Error moving {src} to {dst}: {e}")
+                    continue
+                journal.write(json.dumps({'done': index}) + '\n')
+                journal.flush()
+        os.remove(self.journal_path)
+        self.moves = []
+        return failures
+
+def recover(journal_path, roll_back=False):
+    """Finish (or with roll_back undo) the moves of an interrupted batch and remove its journal.
+
+    Returns the number of files moved. Does nothing if there is no journal.
+    """
+    if not os.path.exists(journal_path):
+        return 0
+    with open(journal_path, 'r') as f:
+        lines = f.read().splitlines()
+    moves, done = [], set()
+    for number, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # Torn last line, or a plan that was never fully written (and so never started)
+        if number == 0:
+            moves = record['moves']
+        else:
+            done.add(record['done'])
+
+    moved = 0
+    for index, (src, dst) in enumerate(moves):
+        if os.path.exists(dst + '.part'):
+            os.remove(dst + '.part')  # Cross device copy that never finished; the source is still in place
+        # A move without a done record may still have happened if the run stopped before recording it
+        finished = index in done or (os.path.exists(dst) and not os.path.exists(src))
+        if roll_back:
+            if finished and os.path.exists(dst) and not os.path.exists(src):
+                move_file(dst, src)
+                moved += 1
+        elif not finished and os.path.exists(src):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            move_file(src, dst)
+            moved += 1
+    os.remove(journal_path)
+    return moved
+
+def recover_pending(directory):
+    """Roll forward a batch of moves in directory left unfinished by an earlier run, reporting what was done."""
+    journal_path = journal_path_for(directory)
+    if os.path.exists(journal_path):
+        print(f"Completed {recover(journal_path)} moves left over from an interrupted run in {directory}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Recover the file moves of an interrupted run.")
+    parser.add_argument('journal', help=f"Move journal, or the directory holding {MOVE_JOURNAL_NAME}")
+    parser.add_argument('--roll-back', action='store_true', help="Put moved files back instead of finishing the moves")
+    args = parser.parse_args()
+
+    journal_path = journal_path_for(args.journal) if os.path.isdir(args.journal) else args.journal
+    if not os.path.exists(journal_path):
+        sys.exit(f"No move journal at {journal_path}")
+    print(f"{'Rolled back' if args.roll_back else 'Completed'} {recover(journal_path, args.roll_back)} moves")
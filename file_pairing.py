@@ -0,0 +1,78 @@
+### JPG/DNG pairing check.
+### Every specimen should be delivered as a JPG and a raw DNG with the same barcode. Filenames from a directory
+### snapshot are grouped by barcode in one pass and each group is checked for a missing half, extra variants
+### (V0507989F_a.jpg) and duplicates (.jpg next to .jpeg, .dng next to .cr2, or V0507989F.jpg.jpg).
+### Works on names only, so it is linear in the listing and makes no filesystem calls.
+
+import os
+import re
+
+JPG_EXTENSIONS = ('.jpg', '.jpeg')
+RAW_EXTENSIONS = ('.dng', '.cr2')
+STEM_PATTERN = re.compile(r'^([VC]\d{7}F)(?:_(\w+))?$', re.IGNORECASE)
+
+def parse_name(filename):
+    """Return (barcode, variant, kind, repeated_extension) for a capture, or None for other files.
+
+    kind is 'jpg' or 'raw'; variant is the suffix after '_' or None; repeated_extension is True for names such as
+    V0507989F.jpg.jpg.
+    """
+    stem, extension = os.path.splitext(filename)
+    extension = extension.lower()
+    if extension in JPG_EXTENSIONS:
+        kind = 'jpg'
+    elif extension in RAW_EXTENSIONS:
+        kind = 'raw'
+    else:
+        return None
+    repeated_extension = False
+    while os.path.splitext(stem)[1].lower() in JPG_EXTENSIONS + RAW_EXTENSIONS:
+        stem = os.path.splitext(stem)[0]
+        repeated_extension = True
+    match = STEM_PATTERN.match(stem)
+    if match is None:
+        return None
+    return match.group(1).upper(), match.group(2), kind, repeated_extension
+
+def group_by_barcode(filenames):
+    """Return {barcode: [(filename, variant, kind, repeated_extension)]} for the captures in a listing."""
+    groups = {}
+    for filename in filenames:
+        parsed = parse_name(filename)
+        if parsed is not None:
+            barcode, variant, kind, repeated_extension = parsed
+            groups.setdefault(barcode, []).append((filename, variant, kind, repeated_extension))
+    return groups
+
+def check_pairs(filenames):
+    """Return {filename: issue} for every capture in the listing with a pairing problem.
+
+    Several issues for one file are joined with '; '. Files without issues are left out.
+    """
+    issues = {}
+
+    def add(filename, issue):
+        issues[filename] = f"{issues[filename]}; {issue}" if filename in issues else issue
+
+    for barcode, files in group_by_barcode(filenames).items():
+        base = {'jpg': [], 'raw': []}
+        for filename, variant, kind, repeated_extension in files:
+            if repeated_extension:
+                add(filename, "Duplicate extension")
+            elif variant is not None:
+                add(filename, f"Extra variant _{variant} of {barcode}")
+            else:
+                base[kind].append(filename)
+
+        jpgs, raws = base['jpg'], base['raw']
+        for filename in jpgs:
+            if not raws:
+                add(filename, "JPG without DNG")
+            if len(jpgs) > 1:
+                add(filename, f"Duplicate JPG: {', '.join(sorted(jpgs))}")
+        for filename in raws:
+            if not jpgs:
+                add(filename, "DNG without JPG")
+            if len(raws) > 1:
+                add(filename, f"Duplicate raw: {', '.join(sorted(raws))}")
+    return issues
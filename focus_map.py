@@ -0,0 +1,111 @@
+### Tiled focus analysis.
+### check_focus takes one Laplacian variance over the whole frame, which mostly measures the blank mounting paper
+### and needs a float64 image the size of the frame. Here the sheet is cut into tiles and the variance of each tile
+### comes from integral images of the Laplacian and its square, one band of tiles at a time: the Laplacian is kept in
+### int16 and only a band is ever converted. Tiles of plain paper (almost no grey level variation) are left out, so
+### the map shows which parts of the specimen are soft. A pass/fail check can stop as soon as enough sharp tiles
+### have been seen.
+
+import os
+import cv2
+import numpy as np
+from collections import namedtuple
+
+TILE_SIZE = 256                # Tile side in full resolution pixels
+MIN_TILE_SIZE = 16             # Smallest tile side after dividing by the decode scale
+MIN_CONTENT_STD = 12.0         # Grey level standard deviation below which a tile is plain paper
+MIN_SHARP_TILES = 8            # Sharp tiles with content needed for the image to count as in focus
+HEATMAP_CELL = 8               # Heatmap pixels per tile
+HEATMAP_SUFFIX = '_focus.png'
+HEATMAP_DIRNAME = 'focus_maps'
+
+FocusMap = namedtuple('FocusMap', ['sharpness', 'content'])
+
+def _edges(length, tile_size):
+    """Tile boundaries along one axis: tiles of roughly tile_size covering the whole length."""
+    return np.linspace(0, length, max(1, length // tile_size) + 1).astype(int)
+
+def tile_focus(image, tile_size=TILE_SIZE, focus_threshold=None, stop_after=None):
+    """Return the FocusMap of an image: Laplacian variance and has-content flag per tile, as (rows, cols) arrays.
+
+    With focus_threshold and stop_after the scan stops once stop_after tiles with content are sharper than the
+    threshold; rows not reached are NaN in sharpness and False in content.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+    ys, xs = _edges(height, tile_size), _edges(width, tile_size)
+    sharpness = np.full((len(ys) - 1, len(xs) - 1), np.nan)
+    content = np.zeros(sharpness.shape, dtype=bool)
+
+    sharp = 0
+    for row, (top, bottom) in enumerate(zip(ys, ys[1:])):
+        # One row of context above and below so the band's Laplacian matches the full frame's
+        pad_top, pad_bottom = max(top - 1, 0), min(bottom + 1, height)
+        laplacian = cv2.Laplacian(gray[pad_top:pad_bottom], cv2.CV_16S)[top - pad_top:bottom - pad_top]
+        sums, squares = cv2.integral2(laplacian.astype(np.float32), sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        grey_sums, grey_squares = cv2.integral2(gray[top:bottom], sdepth=cv2.CV_32S, sqdepth=cv2.CV_64F)
+
+        # The band is one tile tall, so each tile's total is a difference along the integral images' last row
+        counts = (bottom - top) * np.diff(xs)
+        means = np.diff(sums[-1, xs]) / counts
+        sharpness[row] = np.diff(squares[-1, xs]) / counts - means * means
+        grey_means = np.diff(grey_sums[-1, xs]) / counts
+        grey_variance = np.diff(grey_squares[-1, xs]) / counts - grey_means * grey_means
+        content[row] = grey_variance >= MIN_CONTENT_STD ** 2
+
+        if stop_after is not None and focus_threshold is not None:
+            sharp += int(np.count_nonzero(content[row] & (sharpness[row] > focus_threshold)))
+            if sharp >= stop_after:
+                break
+    return FocusMap(sharpness, content)
+
+def focus_verdict(focus_map, focus_threshold, min_sharp=MIN_SHARP_TILES):
+    """Return (focus measure, in focus, soft tiles) for a FocusMap.
+
+    The measure is the median sharpness of the tiles with content (all scanned tiles if none have content). The
+    image is in focus when min_sharp of those tiles, or all of them if there are fewer, beat the threshold.
+    """
+    scanned = ~np.isnan(focus_map.sharpness)
+    tiles = focus_map.sharpness[scanned & focus_map.content]
+    if tiles.size == 0:
+        tiles = focus_map.sharpness[scanned]
+    sharp = int(np.count_nonzero(tiles > focus_threshold))
+    return float(np.median(tiles)), sharp >= min(min_sharp, tiles.size), tiles.size - sharp
+
+def save_heatmap(focus_map, path, focus_threshold):
+    """Write a small colour map of the tile sharpness: blue is soft, red is sharp, grey is plain paper."""
+    # Log scale centred on the threshold, so the threshold is the middle of the colour range
+    sharpness = np.nan_to_num(focus_map.sharpness, nan=0.0)
+    level = np.log2((sharpness + 1) / (focus_threshold + 1))
+    scaled = np.clip(128 + level * 32, 0, 255).astype(np.uint8)
+    heatmap = cv2.applyColorMap(scaled, cv2.COLORMAP_JET)
+    heatmap[~focus_map.content] = (128, 128, 128)
+    heatmap = cv2.resize(heatmap, None, fx=HEATMAP_CELL, fy=HEATMAP_CELL, interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(path, heatmap)
+
+def make_heatmap_dir(folder):
+    """Create the focus_maps folder inside folder and return its path."""
+    heatmap_dir = os.path.join(folder, HEATMAP_DIRNAME)
+    os.makedirs(heatmap_dir, exist_ok=True)
+    return heatmap_dir
+
+def heatmap_path_for(heatmap_dir, file_path):
+    """V0507989F.jpg -> <heatmap_dir>/V0507989F_focus.png"""
+    return os.path.join(heatmap_dir, os.path.splitext(os.path.basename(file_path))[0] + HEATMAP_SUFFIX)
+
+def add_arguments(parser):
+    """Add the --focus-tiles, --focus-early-exit and --focus-heatmaps options to an argparse parser."""
+    parser.add_argument('--focus-tiles', type=int, nargs='?', const=TILE_SIZE,
+                        help=f"Judge focus per tile of this many pixels ({TILE_SIZE} if no size is given)")
+    parser.add_argument('--focus-early-exit', action='store_true',
+                        help="Stop the tiled focus check once enough sharp tiles are found")
+    parser.add_argument('--focus-heatmaps', action='store_true',
+                        help=f"Write a focus heatmap of every image to the {HEATMAP_DIRNAME} folder")
+
+def options_from_args(args):
+    """Return (focus_tiles, focus_early_exit, heatmaps) for the add_arguments options.
+
+    The early exit and the heatmaps both need the tiled check, so either turns it on at the default tile size.
+    """
+    focus_tiles = args.focus_tiles or (TILE_SIZE if args.focus_early_exit or args.focus_heatmaps else None)
+    return focus_tiles, args.focus_early_exit, args.focus_heatmaps
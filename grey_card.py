@@ -0,0 +1,157 @@
+### Grey card location for the white balance check.
+### The white balance is judged on the grey card photographed with each sheet instead of the whole frame, whose
+### average mostly measures the specimen and the paper. The card is found once on a small copy of the frame: the
+### largest uniform, unsaturated, mid grey rectangle. Its location is kept as fractions of the frame per imaging
+### station and session, since the card rarely moves; each image only confirms the patch still looks like the card
+### and measures the channel means over those few thousand pixels.
+
+import os
+import json
+import time
+import cv2
+import numpy as np
+from raw_preview import is_raw_file, read_raw_preview
+
+DEFAULT_LOCATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grey_card_locations.json')
+DEFAULT_GREY_CARD_THRESHOLD = 0.05  # Largest channel difference on a neutral card, on a 0-1 scale
+
+LOCATOR_SIZE = 400            # Long side of the frame the locator searches, in pixels
+MAX_SATURATION = 40           # HSV saturation (0-255) still counted as grey
+GREY_RANGE = (50, 200)        # Brightness of a grey card; white paper and black text fall outside it
+MAX_LOCAL_STD = 8.0           # Brightness standard deviation over a 7x7 window on the card
+MIN_CARD_FRACTION = 0.002     # Smallest card area as a fraction of the frame
+MIN_FILL = 0.7                # Card pixels as a fraction of their bounding box, i.e. roughly rectangular
+ROI_MARGIN = 0.2              # Fraction of the card trimmed from each side to stay clear of its edges
+
+def _to_8bit(image):
+    """Scale a 16 bit frame (TIFF, RAW) down to 8 bits: the HSV thresholds above are on a 0-255 scale."""
+    if image.dtype == np.uint8:
+        return image
+    return cv2.convertScaleAbs(image, alpha=255.0 / np.iinfo(image.dtype).max)
+
+def locate_grey_card(image):
+    """Find the grey card in a decoded frame. Returns its ROI as (x, y, width, height) fractions, or None."""
+    height, width = image.shape[:2]
+    factor = LOCATOR_SIZE / max(height, width)
+    small = cv2.resize(image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1 else image
+    small_height, small_width = small.shape[:2]
+
+    hsv = cv2.cvtColor(_to_8bit(small), cv2.COLOR_BGR2HSV)
+    value = hsv[:, :, 2].astype(np.float32)
+    mean = cv2.blur(value, (7, 7))
+    std = np.sqrt(np.maximum(cv2.blur(value * value, (7, 7)) - mean * mean, 0))
+    mask = ((hsv[:, :, 1] <= MAX_SATURATION) & (value >= GREY_RANGE[0]) & (value <= GREY_RANGE[1])
+            & (std <= MAX_LOCAL_STD)).astype(np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+    best = None
+    for x, y, w, h, area in stats[1:count]:
+        if area < MIN_CARD_FRACTION * small_height * small_width or area < MIN_FILL * w * h:
+            continue
+        if best is None or area > best[4]:
+            best = (x, y, w, h, area)
+    if best is None:
+        return None
+
+    x, y, w, h, _ = best
+    x, y, w, h = x + w * ROI_MARGIN, y + h * ROI_MARGIN, w * (1 - 2 * ROI_MARGIN), h * (1 - 2 * ROI_MARGIN)
+    return tuple(round(float(v), 4) for v in (x / small_width, y / small_height, w / small_width, h / small_height))
+
+def roi_patch(image, roi):
+    """Return the pixels of an image inside a fractional ROI."""
+    height, width = image.shape[:2]
+    x, y, w, h = roi
+    left, top = int(x * width), int(y * height)
+    right, bottom = max(left + 1, int((x + w) * width)), max(top + 1, int((y + h) * height))
+    return image[top:bottom, left:right]
+
+def is_grey_card(image, roi):
+    """Check the ROI still shows a uniform, unsaturated, mid grey patch, i.e. the card has not moved."""
+    patch = roi_patch(image, roi)
+    if patch.size == 0:
+        return False
+    hsv = cv2.cvtColor(_to_8bit(patch), cv2.COLOR_BGR2HSV)
+    mean, std = cv2.meanStdDev(hsv[:, :, 2])
+    saturation = cv2.mean(hsv[:, :, 1])[0]
+    # A whole patch varies a little more than the 7x7 windows the locator looks at
+    return (saturation <= MAX_SATURATION and GREY_RANGE[0] <= mean[0][0] <= GREY_RANGE[1]
+            and std[0][0] <= 2 * MAX_LOCAL_STD)
+
+def grey_card_means(image, roi):
+    """Return the mean of each channel over the grey card ROI, on a 0-1 scale like check_white_balance."""
+    return np.array(cv2.mean(roi_patch(image, roi))[:3]) / np.iinfo(image.dtype).max
+
+def session_key(station, session=None):
+    """Key a location by imaging station and session (today's date unless given)."""
+    return f"{station}/{session or time.strftime('%Y-%m-%d')}"
+
+class GreyCardLocations:
+    """Grey card ROI per imaging station and session, kept between runs."""
+
+    def __init__(self, path=DEFAULT_LOCATIONS_PATH):
+        self.path = path
+        self.locations = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.locations = json.load(f)
+
+    def get(self, key):
+        roi = self.locations.get(key)
+        return tuple(roi) if roi else None
+
+    def set(self, key, roi):
+        self.locations[key] = list(roi)
+
+    def save(self):
+        """Write the locations back to disk, atomically replacing the previous file."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.locations, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+def _read_small(file_path):
+    # 1/8 resolution (the embedded preview of raw files) is plenty for the locator's 400 pixel copy
+    if is_raw_file(file_path):
+        return read_raw_preview(file_path, cv2.IMREAD_REDUCED_COLOR_8)
+    return cv2.imread(file_path, cv2.IMREAD_REDUCED_COLOR_8)
+
+class GreyCardSession:
+    """The grey card ROI of one station and session over a run.
+
+    roi is the cached location, or the card located on the first sample images; True (locate the card in every
+    image) if it is not found there either. update caches the ROI an image was measured on, so a card found later
+    in the run, or found again after it moved, is kept for the rest of the session.
+    """
+
+    def __init__(self, key, file_paths, locations=None, sample=5):
+        self.key = key
+        self.locations = locations if locations is not None else GreyCardLocations()
+        self.roi = self.locations.get(key) or True
+        if self.roi is True:
+            for file_path in file_paths[:sample]:
+                image = _read_small(file_path)
+                roi = locate_grey_card(image) if image is not None else None
+                if roi is not None:
+                    self.update(roi)
+                    break
+
+    def update(self, roi):
+        """Cache the ROI an image's white balance was measured on, if it is not the current one."""
+        if roi is not None and roi != self.roi:
+            self.roi = roi
+            self.locations.set(self.key, roi)
+            self.locations.save()
+
+def add_arguments(parser, station_default="the folder name"):
+    """Add the --grey-card, --station and --session options to an argparse parser."""
+    parser.add_argument('--grey-card', action='store_true', help="Measure white balance on the grey card")
+    parser.add_argument('--station', help=f"Imaging station the grey card location is cached for "
+                                          f"(defaults to {station_default})")
+    parser.add_argument('--session', help="Session the grey card location is cached for (defaults to today)")
+
+def key_from_args(args, folder):
+    """Return the location key for the add_arguments options, or None without --grey-card."""
+    if not args.grey_card:
+        return None
+    return session_key(args.station or os.path.basename(os.path.abspath(folder)), args.session)
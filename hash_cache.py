@@ -0,0 +1,176 @@
+### Persistent MD5 cache shared by every script that hashes images.
+### A cached digest is reused only while the file's path, size, mtime_ns and inode are unchanged,
+### so the twice daily runs only hash files that are new or have been modified since they were last seen.
+
+import os
+import json
+import hashlib
+import argparse
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'md5_cache.json')
+DEFAULT_MAX_ENTRIES = 500000
+
+def file_signature(file_path, st=None):
+    """Return the [size, mtime_ns, inode] signature a cached hash is valid for."""
+    if st is None:
+        st = os.stat(file_path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def calculate_md5(file_path):
+    """Calculate the MD5 hash of a file."""
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+class HashCache:
+    """On-disk MD5 cache with LRU eviction.
+
+    Entries are kept in least to most recently used order and stored as
+    path -> [size, mtime_ns, inode, md5]. In verify mode cached digests are never
+    trusted: every file is rehashed and any digest that changed while the file
+    signature did not is recorded in ``mismatches``.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, verify=False):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.verify = verify
+        self.entries = OrderedDict()
+        self.mismatches = []
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        """Load the cache file if it exists."""
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read hash cache {self.cache_path} ({e}). Starting with an empty cache.")
+            return
+        self.entries = OrderedDict((path, entry) for path, entry in data)
+        self._evict()
+
+    def save(self):
+        """Write the cache back to disk, atomically replacing the previous file."""
+        if not self.dirty:
+            return
+        # One temporary file per process, so two scripts saving at once cannot write into the same one
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.entries.items()), f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+    def lookup(self, file_path, st=None):
+        """Return the cached MD5 for an unchanged file, or None if it has to be hashed."""
+        key = os.path.abspath(file_path)
+        entry = self.entries.get(key)
+        if entry is None or self.verify or entry[:3] != file_signature(file_path, st):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def peek(self, file_path, st=None):
+        """Like lookup, but without counting a hit or miss or marking the entry as recently used."""
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is None or self.verify or entry[:3] != file_signature(file_path, st):
+            return None
+        return entry[3]
+
+    def store(self, file_path, md5, st=None):
+        """Record the MD5 of a file against its current signature."""
+        key = os.path.abspath(file_path)
+        signature = file_signature(file_path, st)
+        previous = self.entries.get(key)
+        if self.verify and previous is not None and previous[:3] == signature and previous[3] != md5:
+            self.mismatches.append({'Filename': key, 'Cached MD5': previous[3], 'MD5': md5})
+        self.entries[key] = signature + [md5]
+        self.entries.move_to_end(key)
+        self.dirty = True
+        self._evict()
+
+    def get_md5(self, file_path, hash_func=calculate_md5):
+        """Return the MD5 of a file, hashing it with hash_func only on a cache miss."""
+        st = os.stat(file_path)
+        md5 = self.lookup(file_path, st)
+        if md5 is None:
+            md5 = hash_func(file_path)
+            self.store(file_path, md5, st)
+        return md5
+
+    def invalidate(self, path=None):
+        """Drop cached hashes for a file, for everything under a directory, or for the whole cache."""
+        if path is None:
+            removed = len(self.entries)
+            self.entries.clear()
+        else:
+            path = os.path.abspath(path)
+            prefix = os.path.join(path, '')
+            stale = [key for key in self.entries if key == path or key.startswith(prefix)]
+            for key in stale:
+                del self.entries[key]
+            removed = len(stale)
+        if removed:
+            self.dirty = True
+        return removed
+
+    def stats(self):
+        """Return a one line summary of cache usage for this run."""
+        return f"Hash cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries"
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.dirty = True
+
+def verify_cache(cache, hash_func=calculate_md5, directory=None):
+    """Rehash every cached file (optionally only those under directory) and report digest changes."""
+    prefix = os.path.join(os.path.abspath(directory), '') if directory else ''
+    mismatches = []
+    for path, entry in list(cache.entries.items()):
+        if not path.startswith(prefix):
+            continue
+        if not os.path.isfile(path):
+            del cache.entries[path]
+            cache.dirty = True
+            continue
+        st = os.stat(path)
+        md5 = hash_func(path)
+        if entry[:3] == file_signature(path, st) and entry[3] != md5:
+            mismatches.append({'Filename': path, 'Cached MD5': entry[3], 'MD5': md5})
+        cache.store(path, md5, st)
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, verify or invalidate the shared MD5 cache.")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="Path to the cache file")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--invalidate', nargs='?', const='', metavar='PATH',
+                       help="Drop cached hashes under PATH, or the whole cache if no path is given")
+    group.add_argument('--verify', nargs='?', const='', metavar='DIR',
+                       help="Rehash cached files under DIR (or all cached files) and report changed digests")
+    args = parser.parse_args()
+
+    cache = HashCache(args.cache)
+    if args.invalidate is not None:
+        removed = cache.invalidate(args.invalidate or None)
+        print(f"Removed {removed} cached hashes.")
+    else:
+        mismatches = verify_cache(cache, directory=args.verify or None)
+        for mismatch in mismatches:
+            print(f"[HASH CHANGED] {mismatch['Filename']}: {mismatch['Cached MD5']} -> {mismatch['MD5']}")
+        print(f"Verified cache, {len(mismatches)} files changed without a change in size or mtime.")
+    cache.save()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+### Parallel MD5 hashing for the directory comparison scripts.
+### hashlib releases the GIL while digesting large buffers, so a thread pool reading MB sized blocks
+### keeps the NAS busy instead of pegging one core on 4 KB reads.
+
+import os
+import mmap
+import shutil
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024  # 8 MB reads
+DEFAULT_WORKERS = 8
+PARTIAL_BLOCK_SIZE = 64 * 1024  # Bytes read from each end of a file for the partial digest
+
+def hash_file(file_path, buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False, algorithm='md5'):
+    """Hash a file with large reads into a reused buffer, or through a memory map."""
+    hasher = hashlib.new(algorithm)
+    with open(file_path, 'rb', buffering=0) as f:
+        if use_mmap:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    for offset in range(0, len(view), buffer_size):
+                        hasher.update(view[offset:offset + buffer_size])
+        else:
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                hasher.update(view[:read])
+    return hasher.hexdigest()
+
+def copy_and_hash(src, dst, algorithms=('md5',), buffer_size=DEFAULT_BUFFER_SIZE):
+    """Copy src to dst like shutil.copy2, hashing the data on the way through. Returns {algorithm: hexdigest}.
+
+    One read and one write instead of copying and then reading both files again to verify. The data goes to
+    dst + '.part' and is renamed into place only once it has all been written and flushed to disk.
+    """
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    part_path = dst + '.part'
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    try:
+        with open(src, 'rb', buffering=0) as fsrc, open(part_path, 'wb', buffering=0) as fdst:
+            while True:
+                read = fsrc.readinto(buffer)
+                if not read:
+                    break
+                for hasher in hashers:
+                    hasher.update(view[:read])
+                written = 0
+                while written < read:
+                    written += fdst.write(view[written:read])
+            os.fsync(fdst.fileno())
+        shutil.copystat(src, part_path)
+        os.replace(part_path, dst)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)}
+
+def partial_hash(file_path, block_size=PARTIAL_BLOCK_SIZE):
+    """Hash the size, first block and last block of a file.
+
+    Cheap screen for files of equal size: truncation, re-exports and most transfer damage change the head or tail.
+    Equal partial digests do not prove the files are identical.
+    """
+    hasher = hashlib.md5()
+    with open(file_path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        hasher.update(str(size).encode())
+        hasher.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            hasher.update(f.read(block_size))
+    return hasher.hexdigest()
+
+class HashEngine:
+    """Hash files on a thread pool, reusing digests from an optional HashCache.
+
+    Throughput is accumulated across calls so a whole run can be reported at the end.
+    """
+
+    def __init__(self, cache=None, workers=DEFAULT_WORKERS, buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False):
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.buffer_size = buffer_size
+        self.use_mmap = use_mmap
+        self.files_hashed = 0
+        self.bytes_hashed = 0
+        self.seconds = 0.0
+        self.files_sampled = 0
+
+    def _hash(self, file_path):
+        return hash_file(file_path, self.buffer_size, self.use_mmap)
+
+    def md5(self, file_path):
+        """Return the MD5 of a single file."""
+        return self.md5_many([file_path])[file_path]
+
+    def md5_many(self, file_paths):
+        """Return {path: md5} for all paths, hashing cache misses in parallel."""
+        hashes = {}
+        pending = []
+        for file_path in dict.fromkeys(file_paths):
+            st = os.stat(file_path)
+            md5 = self.cache.lookup(file_path, st) if self.cache is not None else None
+            if md5 is None:
+                pending.append((file_path, st))
+            else:
+                hashes[file_path] = md5
+        if not pending:
+            return hashes
+
+        start = time.perf_counter()
+        if self.workers == 1 or len(pending) == 1:
+            digests = [self._hash(file_path) for file_path, _ in pending]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+                digests = list(pool.map(self._hash, [file_path for file_path, _ in pending]))
+        self.seconds += time.perf_counter() - start
+
+        for (file_path, st), md5 in zip(pending, digests):
+            hashes[file_path] = md5
+            self.files_hashed += 1
+            self.bytes_hashed += st.st_size
+            if self.cache is not None:
+                self.cache.store(file_path, md5, st)
+        return hashes
+
+    def remember(self, file_path, md5):
+        """Cache an MD5 computed elsewhere (e.g. while copying) so the file is not read again to hash it."""
+        if self.cache is not None:
+            self.cache.store(file_path, md5, os.stat(file_path))
+
+    def cached_md5(self, file_path):
+        """Return the cached MD5 of a file if it is still valid, without reading the file."""
+        return self.cache.peek(file_path, os.stat(file_path)) if self.cache is not None else None
+
+    def partial_many(self, file_paths):
+        """Return {path: partial digest} for all paths, reading only the ends of each file, in parallel."""
+        file_paths = list(dict.fromkeys(file_paths))
+        if self.workers == 1 or len(file_paths) <= 1:
+            digests = [partial_hash(file_path) for file_path in file_paths]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(file_paths))) as pool:
+                digests = list(pool.map(partial_hash, file_paths))
+        self.files_sampled += len(file_paths)
+        return dict(zip(file_paths, digests))
+
+    def throughput(self):
+        """Return the hashing rate in bytes per second."""
+        return self.bytes_hashed / self.seconds if self.seconds else 0.0
+
+    def report(self):
+        """Return a one line summary of hashing throughput for this run."""
+        return (f"Hashed {self.files_hashed} files ({self.bytes_hashed / 1e6:.1f} MB) in {self.seconds:.1f}s "
+                f"at {self.throughput() / 1e6:.1f} MB/s with {self.workers} workers"
+                + (f", {self.files_sampled} partial digests" if self.files_sampled else ""))
@@ -1,60 +1,64 @@
 import os
-import cv2
-import numpy as np
-import pandas as pd
+import argparse
+import functools
+from qc_engine import run_qc, DEFAULT_WORKERS
+from qc_metrics import analyse_image, load_thresholds, REDUCED_DECODE_FLAGS
+import grey_card
+import focus_map
+from grey_card import GreyCardLocations, GreyCardSession, DEFAULT_LOCATIONS_PATH
+from report_writer import ReportWriter
 
-def check_white_balance(image):
-    img_float = image.astype(np.float32) / 255.0
-    means = img_float.mean(axis=(0, 1))  # Calculate mean of RGB channels
-    return means
+RESULT_FIELDS = ['Filename', 'White Balance (R,G,B)', 'Focus Measure', 'In Focus', 'White Balanced',
+                 'White Balance Source', 'Grey Card ROI', 'Soft Tiles', 'Clipped Shadows', 'Clipped Highlights']
 
-def is_white_balanced(means, threshold=0.1):
-    # Define a simple threshold for white balance
-    return abs(means[0] - means[1]) < threshold and abs(means[1] - means[2]) < threshold
-
-def check_focus(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    focus_measure = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return focus_measure
-
-def is_in_focus(focus_measure, focus_threshold=100.0):
-    return focus_measure > focus_threshold
-
-def process_images(folder_path):
-    results = []
+# grey_card_key (station/session) turns on white balance measured on the grey card, located once per session
+# focus_tiles turns on the tiled focus check (see qc_metrics.analyse_image), heatmaps go to folder_path/focus_maps
+def process_images(folder_path, workers=DEFAULT_WORKERS, scale=1, grey_card_key=None,
+                   locations_path=DEFAULT_LOCATIONS_PATH, focus_tiles=None, focus_early_exit=False, heatmaps=False):
     valid_extensions = ('.jpg', '.jpeg', '.tif', '.tiff', '.dng', '.cr2')
 
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(valid_extensions):
-            file_path = os.path.join(folder_path, filename)
-            image = cv2.imread(file_path)
+    # Sorted so the report order does not depend on the directory listing or the number of workers
+    filenames = sorted(f for f in os.listdir(folder_path) if f.lower().endswith(valid_extensions))
+    file_paths = [os.path.join(folder_path, filename) for filename in filenames]
+
+    # Metrics on reduced resolution decodes are judged against thresholds calibrated for that scale
+    focus_threshold, wb_threshold = load_thresholds(scale)
+    session = None
+    if grey_card_key is not None:
+        session = GreyCardSession(grey_card_key, file_paths, GreyCardLocations(locations_path))
+        print(f"Grey card for {grey_card_key}: "
+              f"{session.roi if session.roi is not True else 'not found, locating per image'}")
+    heatmap_dir = focus_map.make_heatmap_dir(folder_path) if heatmaps else None
+    analyse = functools.partial(analyse_image, scale=scale, focus_threshold=focus_threshold, wb_threshold=wb_threshold,
+                                grey_card=session.roi if session else None, focus_tiles=focus_tiles,
+                                focus_early_exit=focus_early_exit, heatmap_dir=heatmap_dir)
 
-            if image is None:
+    # White balance and focus checks run on a process pool; results come back in file order
+    # and each one is written to the CSV as soon as it arrives
+    with ReportWriter(os.path.join(folder_path, 'image_analysis_results.csv'), RESULT_FIELDS) as results:
+        for filename, (_, analysis) in zip(filenames, run_qc(file_paths, workers, func=analyse)):
+            if analysis is None:
                 print(f"Could not read image: {filename}")
                 continue
 
-            # Check white balance
-            white_balance = check_white_balance(image)
-            white_balanced = is_white_balanced(white_balance)
-
-            # Check focus
-            focus = check_focus(image)
-            in_focus = is_in_focus(focus)
-
             # Append the results
-            results.append({
-                'Filename': filename,
-                'White Balance (R,G,B)': white_balance,
-                'Focus Measure': focus,
-                'In Focus': in_focus,
-                'White Balanced': white_balanced
-            })
-
-    # Create a DataFrame and save to CSV
-    df = pd.DataFrame(results)
-    df.to_csv(os.path.join(folder_path, 'image_analysis_results.csv'), index=False)
+            results.append({'Filename': filename, **analysis})
+
+            # A card only found further into the batch, or found again after it moved, is cached for the session
+            if session is not None:
+                session.update(analysis['Grey Card ROI'])
 
 if __name__ == "__main__":
-    folder_path = input("Enter the folder path containing images: ")
-    process_images(folder_path)
+    parser = argparse.ArgumentParser(description="Check white balance and focus of every image in a folder.")
+    parser.add_argument('folder_path', nargs='?', help="Folder containing images (prompted for if omitted)")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of QC worker processes")
+    parser.add_argument('--scale', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=1,
+                        help="Decode images at 1/scale resolution for the QC metrics")
+    grey_card.add_arguments(parser)
+    focus_map.add_arguments(parser)
+    args = parser.parse_args()
+    folder_path = args.folder_path or input("Enter the folder path containing images: ")
+    focus_tiles, focus_early_exit, heatmaps = focus_map.options_from_args(args)
+    process_images(folder_path, args.workers, args.scale, grey_card.key_from_args(args, folder_path),
+                   focus_tiles=focus_tiles, focus_early_exit=focus_early_exit, heatmaps=heatmaps)
     print("Image analysis completed and results saved to CSV.")
@@ -0,0 +1,31 @@
+### Single read per image: the file is read into memory once, and the same bytes feed both the MD5 digest
+### and cv2.imdecode, so hashing, corruption checks and pixel QC no longer read each image three times.
+
+import os
+import hashlib
+import cv2
+import numpy as np
+from raw_preview import decode_raw_preview
+
+def read_and_hash(file_path, cache=None):
+    """Read a whole file and return (data, md5), recording the digest in the hash cache if given."""
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    md5 = hashlib.md5(data).hexdigest()
+    if cache is not None:
+        cache.store(file_path, md5, st)
+    return data, md5
+
+def decode_image(data, flags=cv2.IMREAD_COLOR, raw=False):
+    """Decode an in-memory image, or the embedded preview of a raw file, returning None if it cannot be read."""
+    if not data:
+        return None
+    if raw:
+        return decode_raw_preview(data, flags)
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+def load_image(file_path, cache=None, flags=cv2.IMREAD_COLOR, raw=False):
+    """Read a file once and return (md5, decoded image or None)."""
+    data, md5 = read_and_hash(file_path, cache)
+    return md5, decode_image(data, flags, raw)
@@ -0,0 +1,198 @@
+### Structural corruption checks that do not decode pixels.
+### JPEG: SOI, marker segment walk up to the first scan, and an EOI marker near the end (trailers may follow it).
+### TIFF/DNG/CR2: header, IFD chain (including SubIFDs and the EXIF IFD), out-of-line value bounds and
+### strip/tile/preview offsets against the file size.
+### Only headers and the file tail are read, so screening runs at disk speed. A full decode is left to deep mode.
+
+import io
+import os
+import struct
+import cv2
+
+# Byte size of each TIFF field type
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS = 273, 279
+TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS = 324, 325
+TIFF_JPEG_OFFSET, TIFF_JPEG_LENGTH = 513, 514
+TIFF_SUB_IFDS, TIFF_EXIF_IFD = 330, 34665
+MAX_IFDS = 256
+
+# Start of frame markers (C4 is DHT, C8 is reserved and CC is DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Bytes at the end of a JPEG searched for the end of image marker; room for padding and camera/vendor trailers
+JPEG_TAIL_WINDOW = 256 * 1024
+
+# Extensions OpenCV can fully decode for the deep check
+DECODABLE_EXTENSIONS = ('.jpg', '.jpeg', '.tif', '.tiff')
+
+def _read_exact(f, offset, length):
+    f.seek(offset)
+    data = f.read(length)
+    if len(data) != length:
+        raise ValueError(f"Unexpected end of file at offset {offset}")
+    return data
+
+def check_jpeg(f, size):
+    """Return None if the JPEG structure is intact, otherwise the reason it is not."""
+    pos = 2
+    seen_frame = False
+    while True:
+        if pos + 2 > size:
+            return "Truncated before image data"
+        marker = _read_exact(f, pos, 2)
+        if marker[0] != 0xFF:
+            return f"Invalid marker at offset {pos}"
+        if marker[1] == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        code = marker[1]
+        if code == 0xD9:
+            return "End of image before image data"
+        if code == 0x01 or 0xD0 <= code <= 0xD7:  # Markers without a length
+            pos += 2
+            continue
+        if pos + 4 > size:
+            return "Truncated segment header"
+        length = struct.unpack('>H', _read_exact(f, pos + 2, 2))[0]
+        if length < 2 or pos + 2 + length > size:
+            return f"Segment 0x{code:02X} at offset {pos} extends past end of file"
+        if code in JPEG_SOF_MARKERS:
+            if length < 8:
+                return "Invalid frame header"
+            height, width = struct.unpack('>HH', _read_exact(f, pos + 5, 4))
+            if width == 0:
+                return "Frame has zero width"
+            seen_frame = True
+        if code == 0xDA:  # Start of scan, entropy coded data follows
+            break
+        pos += 2 + length
+
+    if not seen_frame:
+        return "Scan without a frame header"
+    # EOI need not be the last bytes: trailers and padding may follow it. Entropy coded data stuffs every FF with
+    # 00, so FF D9 only turns up in the scan as the real marker.
+    start = max(pos, size - JPEG_TAIL_WINDOW)
+    if b'\xFF\xD9' not in _read_exact(f, start, size - start):
+        return "Missing end of image marker (file truncated)"
+    return None
+
+def read_tiff_values(f, endian, size, entry):
+    """Return the integer values of an IFD entry, reading out-of-line data after bounds checking it."""
+    tag, field_type, count, raw = entry
+    item_size = TIFF_TYPE_SIZES.get(field_type)
+    if item_size is None:
+        return None
+    length = item_size * count
+    if length <= 4:
+        data = raw[:length]
+    else:
+        offset = struct.unpack(endian + 'I', raw)[0]
+        if offset + length > size:
+            raise ValueError(f"Tag {tag} data extends past end of file")
+        data = _read_exact(f, offset, length)
+    if field_type == 3:
+        return struct.unpack(f'{endian}{count}H', data)
+    if field_type in (4, 13):
+        return struct.unpack(f'{endian}{count}I', data)
+    return None
+
+def iter_tiff_ifds(f, size):
+    """Yield (endian, tags) for every IFD in a TIFF based file, following the chain, SubIFDs and the EXIF IFD.
+
+    tags maps tag -> (tag, type, count, raw 4 byte value). Raises ValueError on a broken structure.
+    """
+    header = _read_exact(f, 0, 8)
+    endian = '<' if header[:2] == b'II' else '>'
+    magic, first_ifd = struct.unpack(endian + 'HI', header[2:8])
+    if magic == 43:
+        return  # BigTIFF: not used for captures, structure not walked
+    if magic != 42:
+        raise ValueError("Invalid TIFF header")
+
+    pending = [first_ifd]
+    visited = set()
+    while pending:
+        ifd_offset = pending.pop()
+        if ifd_offset == 0 or ifd_offset in visited:
+            continue
+        visited.add(ifd_offset)
+        if len(visited) > MAX_IFDS:
+            raise ValueError("Too many IFDs")
+        if ifd_offset + 2 > size:
+            raise ValueError(f"IFD at offset {ifd_offset} is past end of file")
+        count = struct.unpack(endian + 'H', _read_exact(f, ifd_offset, 2))[0]
+        if ifd_offset + 2 + 12 * count + 4 > size:
+            raise ValueError(f"IFD at offset {ifd_offset} extends past end of file")
+        table = _read_exact(f, ifd_offset + 2, 12 * count + 4)
+
+        tags = {}
+        for i in range(count):
+            tag, field_type, value_count = struct.unpack(endian + 'HHI', table[12 * i:12 * i + 8])
+            tags[tag] = (tag, field_type, value_count, table[12 * i + 8:12 * i + 12])
+        yield endian, tags
+
+        for tag in (TIFF_SUB_IFDS, TIFF_EXIF_IFD):
+            if tag in tags:
+                pending.extend(read_tiff_values(f, endian, size, tags[tag]) or ())
+        pending.append(struct.unpack(endian + 'I', table[-4:])[0])
+
+def _check_ranges(tag, offsets, byte_counts, size):
+    if offsets is None or byte_counts is None:
+        return f"Tag {tag} has an unsupported type"
+    if len(offsets) != len(byte_counts):
+        return f"Tag {tag} has {len(offsets)} offsets but {len(byte_counts)} byte counts"
+    for offset, byte_count in zip(offsets, byte_counts):
+        if offset + byte_count > size:
+            return f"Image data at offset {offset} extends past end of file"
+    return None
+
+def check_tiff(f, size):
+    """Return None if the TIFF/DNG/CR2 structure is intact, otherwise the reason it is not."""
+    try:
+        for endian, tags in iter_tiff_ifds(f, size):
+            for offsets_tag, counts_tag in ((TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS),
+                                            (TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS),
+                                            (TIFF_JPEG_OFFSET, TIFF_JPEG_LENGTH)):
+                if offsets_tag in tags or counts_tag in tags:
+                    offsets = read_tiff_values(f, endian, size, tags[offsets_tag]) if offsets_tag in tags else None
+                    counts = read_tiff_values(f, endian, size, tags[counts_tag]) if counts_tag in tags else None
+                    reason = _check_ranges(offsets_tag, offsets, counts, size)
+                    if reason:
+                        return reason
+    except ValueError as e:
+        return str(e)
+    return None
+
+def _check_stream(f, size):
+    if size == 0:
+        return "Empty file"
+    head = _read_exact(f, 0, min(size, 8))
+    try:
+        if head[:3] == b'\xFF\xD8\xFF':
+            return check_jpeg(f, size)
+        if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+            return check_tiff(f, size)
+    except (ValueError, struct.error) as e:
+        return str(e)
+    return "Unrecognised file format"
+
+def check_structure(file_path):
+    """Return None if the file is structurally intact, otherwise the reason it is corrupt."""
+    with open(file_path, 'rb') as f:
+        return _check_stream(f, os.fstat(f.fileno()).st_size)
+
+def check_structure_bytes(data):
+    """Structural check for a file already read into memory."""
+    return _check_stream(io.BytesIO(data), len(data))
+
+def check_corruption(file_path, deep=False):
+    """Return None if the file looks intact, otherwise the reason.
+
+    Deep mode also fully decodes formats OpenCV supports; raw DNG/CR2 only get the structural check.
+    """
+    reason = check_structure(file_path)
+    if reason is None and deep and file_path.lower().endswith(DECODABLE_EXTENSIONS):
+        if cv2.imread(file_path) is None:
+            reason = "Could not be decoded"
+    return reason
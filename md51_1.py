@@ -2,9 +2,12 @@ import os
 import hashlib
 import exifread
 import pandas as pd
+from hash_cache import HashCache
 
-def calculate_md5(file_path):
-    """Calculate the MD5 hash of a file."""
+def calculate_md5(file_path, cache=None):
+    """Calculate the MD5 hash of a file, reusing the cached hash if the file is unchanged."""
+    if cache is not None:
+        return cache.get_md5(file_path, calculate_md5)
     hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
         for chunk in iter(lambda: f.read(4096), b""):
@@ -20,13 +23,14 @@ def extract_exif_data(image_path):
 def main(directory, output_csv):
     """Main function to generate a CSV report of image files and their MD5 hashes."""
     records = []
+    cache = HashCache()  # Hashes of unchanged files are reused between runs
 
     for filename in os.listdir(directory):
         if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.tiff')):
             file_path = os.path.join(directory, filename)
 
             # Calculate MD5 hash
-            md5_hash = calculate_md5(file_path)
+            md5_hash = calculate_md5(file_path, cache)
 
             # Extract EXIF data
             exif_data = extract_exif_data(file_path)
@@ -39,6 +43,8 @@ def main(directory, output_csv):
             }
             records.append(record)
 
+    cache.save()
+
     # Convert records to DataFrame
     df = pd.DataFrame(records)
 
@@ -0,0 +1,163 @@
+### Perceptual hash index for spotting the same sheet imaged twice.
+### Each image gets a 64 bit dHash from a tiny greyscale thumbnail: similar images differ in only a few bits even
+### after re-encoding or a slight shift. Hashes live in an SQLite database with the hash split into four 16 bit
+### chunks, each indexed (multi-index hashing): two hashes within distance d share a chunk within d // 4 bits, so
+### a query only probes those chunk values instead of comparing against every image in the collection.
+
+import os
+import sqlite3
+import argparse
+import itertools
+import functools
+import cv2
+import numpy as np
+from qc_metrics import read_image, REDUCED_DECODE_FLAGS
+from qc_engine import run_qc, DEFAULT_WORKERS
+from report_writer import ReportWriter
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'phash_index.db')
+DEFAULT_MAX_DISTANCE = 6
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+DUPLICATE_FIELDS = ['Filename', 'Perceptual Hash', 'Near Duplicates']
+
+SCHEMA = ["""
+CREATE TABLE IF NOT EXISTS phash (
+    filename TEXT PRIMARY KEY,
+    path TEXT,
+    hash INTEGER NOT NULL,
+    c0 INTEGER NOT NULL,
+    c1 INTEGER NOT NULL,
+    c2 INTEGER NOT NULL,
+    c3 INTEGER NOT NULL
+)
+"""] + [f"CREATE INDEX IF NOT EXISTS phash_c{i} ON phash (c{i})" for i in range(CHUNKS)]
+
+def dhash(image):
+    """Return the 64 bit difference hash of a decoded image: is each pixel of a 9x8 thumbnail brighter than the next."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def image_dhash(file_path, scale=8):
+    """Decode a file at 1/scale resolution and return its dHash, or None if it cannot be decoded."""
+    image = read_image(file_path, scale)
+    return None if image is None else dhash(image)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def _chunks(phash):
+    return [(phash >> (CHUNK_BITS * i)) & ((1 << CHUNK_BITS) - 1) for i in range(CHUNKS)]
+
+def _signed(phash):
+    # SQLite integers are signed 64 bit
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+def _neighbours(value, radius):
+    """Every chunk value within radius bits of value."""
+    values = [value]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), r):
+            values.append(value ^ sum(1 << bit for bit in bits))
+    return values
+
+class PerceptualIndex:
+    """Persistent {filename: dHash} index with near duplicate search across the whole collection."""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}
+        self.connection = sqlite3.connect(path, timeout=30.0)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def __len__(self):
+        self.commit()
+        return self.connection.execute('SELECT COUNT(*) FROM phash').fetchone()[0]
+
+    def add(self, filename, phash, path=None):
+        """Record the hash of a file, replacing any earlier hash for the same filename."""
+        self.pending[filename] = (filename, path, _signed(phash), *_chunks(phash))
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO phash VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        self.pending.values())
+        self.pending = {}
+
+    def query(self, phash, max_distance=DEFAULT_MAX_DISTANCE):
+        """Return [(filename, path, distance)] for indexed images within max_distance bits, closest first."""
+        self.commit()
+        radius = max_distance // CHUNKS
+        candidates = {}
+        for i, value in enumerate(_chunks(phash)):
+            probes = _neighbours(value, radius)
+            for start in range(0, len(probes), 500):
+                batch = probes[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT filename, path, hash FROM phash WHERE c{i} IN ({','.join('?' * len(batch))})", batch)
+                for filename, path, stored in rows:
+                    candidates[filename] = (path, stored & ((1 << 64) - 1))
+        matches = [(filename, path, hamming(phash, stored)) for filename, (path, stored) in candidates.items()]
+        return sorted((m for m in matches if m[2] <= max_distance), key=lambda m: (m[2], m[0]))
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def near_duplicates(index, filename, phash, max_distance=DEFAULT_MAX_DISTANCE):
+    """Return the indexed near duplicates of a file as 'name (distance)' text, or None.
+
+    The file itself and its JPG/DNG partner (same name, other extension) are not counted.
+    """
+    stem = os.path.splitext(filename)[0]
+    matches = [f"{match} ({distance})" for match, _, distance in index.query(phash, max_distance)
+               if match != filename and os.path.splitext(match)[0] != stem]
+    return ', '.join(matches) or None
+
+def find_duplicates(folder_path, index, report, max_distance=DEFAULT_MAX_DISTANCE, workers=DEFAULT_WORKERS, scale=8):
+    """Hash every image in a folder, check it against the index and add it. Returns the number with duplicates."""
+    file_paths = [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path))
+                  if f.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.dng', '.cr2'))]
+    found = 0
+    for file_path, phash in run_qc(file_paths, workers, func=functools.partial(image_dhash, scale=scale)):
+        if phash is None:
+            continue
+        filename = os.path.basename(file_path)
+        duplicates = near_duplicates(index, filename, phash, max_distance)
+        index.add(filename, phash, file_path)
+        report.append({'Filename': filename, 'Perceptual Hash': f"{phash:016x}", 'Near Duplicates': duplicates})
+        found += duplicates is not None
+    return found
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find images that look like ones already in the collection.")
+    parser.add_argument('folder_path', help="Folder of images to hash and check")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help="Perceptual hash index database")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Largest number of differing hash bits counted as a near duplicate")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of worker processes")
+    parser.add_argument('--scale', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=8,
+                        help="Decode images at 1/scale resolution for hashing")
+    args = parser.parse_args()
+
+    output_path = os.path.join(args.folder_path, 'duplicates_report.csv')
+    with PerceptualIndex(args.index) as index, ReportWriter(output_path, DUPLICATE_FIELDS) as report:
+        found = find_duplicates(args.folder_path, index, report, args.max_distance, args.workers, args.scale)
+        print(f"{found} of {len(report)} images have near duplicates among {len(index)} indexed images. "
+              f"Report saved to {output_path}")
@@ -0,0 +1,28 @@
+### Multi-core execution of the per-image QC checks.
+### Images are submitted to a process pool in chunks and results come back in submission order,
+### so reports are identical whatever the worker count.
+
+import os
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+from qc_metrics import analyse_image
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+def _init_worker():
+    # Each worker handles one image at a time, so stop OpenCV from starting its own thread pool per process
+    cv2.setNumThreads(1)
+
+def run_qc(file_paths, workers=DEFAULT_WORKERS, chunksize=None, func=analyse_image):
+    """Run func on every file, yielding (file_path, result) in the order the files were given."""
+    file_paths = list(file_paths)
+    if workers <= 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            yield file_path, func(file_path)
+        return
+
+    workers = min(workers, len(file_paths))
+    if chunksize is None:
+        chunksize = max(1, len(file_paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield from zip(file_paths, pool.map(func, file_paths, chunksize=chunksize))
@@ -0,0 +1,180 @@
+### Pixel QC metrics shared by the QC scripts.
+### Kept in their own module so the process pool in qc_engine can import them in worker processes.
+### Images can be decoded at 1/2, 1/4 or 1/8 resolution (DCT scaled for JPEG) for the metrics; thresholds for
+### reduced scales come from qc_calibration.json, written by calibrate_qc.py.
+### Raw DNG/CR2 files are measured on their largest embedded JPEG preview (see raw_preview).
+### With a grey card ROI the white balance is measured on the card only (see grey_card).
+### Focus can be judged per tile on the parts of the sheet with content instead of the whole frame (see focus_map).
+### measure_image takes every metric straight from the decoded uint8/uint16 buffer: channel means with cv2.mean, an
+### int16 Laplacian and a histogram of the grey image, written into scratch buffers kept from one image to the next,
+### so no float copy of the frame is ever made.
+
+import os
+import json
+import cv2
+import numpy as np
+from collections import namedtuple
+from raw_preview import is_raw_file, read_raw_preview
+from grey_card import locate_grey_card, is_grey_card, grey_card_means, DEFAULT_GREY_CARD_THRESHOLD
+from focus_map import tile_focus, focus_verdict, save_heatmap, heatmap_path_for, MIN_TILE_SIZE, MIN_SHARP_TILES
+
+DEFAULT_FOCUS_THRESHOLD = 100.0
+DEFAULT_WB_THRESHOLD = 0.1
+CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qc_calibration.json')
+
+# imread/imdecode flags for each supported decode scale
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def read_image(file_path, scale=1):
+    """Read an image at full resolution or reduced by a factor of 2, 4 or 8."""
+    if is_raw_file(file_path):
+        return read_raw_preview(file_path, REDUCED_DECODE_FLAGS[scale])
+    return cv2.imread(file_path, REDUCED_DECODE_FLAGS[scale])
+
+def load_thresholds(scale=1, calibration_path=CALIBRATION_PATH):
+    """Return (focus_threshold, wb_threshold) to use for images decoded at the given scale."""
+    if scale == 1:
+        return DEFAULT_FOCUS_THRESHOLD, DEFAULT_WB_THRESHOLD
+    if os.path.exists(calibration_path):
+        with open(calibration_path, 'r') as f:
+            calibration = json.load(f)
+        if str(scale) in calibration:
+            entry = calibration[str(scale)]
+            return entry['focus_threshold'], entry['wb_threshold']
+    print(f"Warning: no calibration for scale 1/{scale} in {calibration_path}. "
+          f"Using full resolution thresholds; run calibrate_qc.py first.")
+    return DEFAULT_FOCUS_THRESHOLD, DEFAULT_WB_THRESHOLD
+
+ImageMetrics = namedtuple('ImageMetrics', ['means', 'focus', 'clipped_shadows', 'clipped_highlights'])
+
+class MetricScratch:
+    """Grey image and Laplacian buffers, reused for every image of the same size and depth."""
+
+    def __init__(self):
+        self.gray = None
+        self.laplacian = None
+
+    def buffers(self, image):
+        """Return (gray, laplacian) buffers for an image, only allocating when its size or depth changes."""
+        shape = image.shape[:2]
+        # An 8 bit Laplacian fits in int16 (at most 4 * 255 either way); deeper images need float32
+        laplacian_dtype = np.int16 if image.dtype == np.uint8 else np.float32
+        if self.gray is None or self.gray.shape != shape or self.gray.dtype != image.dtype:
+            self.gray = np.empty(shape, dtype=image.dtype)
+        if self.laplacian is None or self.laplacian.shape != shape or self.laplacian.dtype != laplacian_dtype:
+            self.laplacian = np.empty(shape, dtype=laplacian_dtype)
+        return self.gray, self.laplacian
+
+# One per process: pool workers measure one image at a time
+_scratch = MetricScratch()
+# Grey cards found away from their session ROI in this process: {session ROI (or True): ROI found}
+_moved_grey_cards = {}
+
+def measure_image(image, focus=True, scratch=_scratch):
+    """Return the ImageMetrics of a uint8 or uint16 image in one pass over its buffer.
+
+    Means and clipped fractions are on a 0-1 scale. focus is the Laplacian variance, or None with focus=False.
+    The grey image is left in scratch.gray for further checks.
+    """
+    full_scale = np.iinfo(image.dtype).max
+    means = np.array(cv2.mean(image)[:3]) / full_scale
+
+    gray, laplacian = scratch.buffers(image)
+    if image.ndim == 3:
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+    else:
+        np.copyto(gray, image)
+    histogram = cv2.calcHist([gray], [0], None, [full_scale + 1], [0, full_scale + 1]).ravel()
+
+    focus_measure = None
+    if focus:
+        cv2.Laplacian(gray, cv2.CV_16S if laplacian.dtype == np.int16 else cv2.CV_32F, dst=laplacian)
+        _, std = cv2.meanStdDev(laplacian)
+        focus_measure = float(std[0][0] ** 2)
+    return ImageMetrics(means, focus_measure, float(histogram[0]) / gray.size, float(histogram[-1]) / gray.size)
+
+def check_white_balance(image):
+    """Calculate the average RGB values of the image."""
+    return np.array(cv2.mean(image)[:3]) / np.iinfo(image.dtype).max
+
+def is_white_balanced(means, threshold=DEFAULT_WB_THRESHOLD):
+    """Check if the image is white balanced based on the average RGB values."""
+    return abs(means[0] - means[1]) < threshold and abs(means[1] - means[2]) < threshold
+
+def check_focus(image):
+    """Calculate the focus measure of the image."""
+    return measure_image(image).focus
+
+def is_in_focus(focus_measure, focus_threshold=DEFAULT_FOCUS_THRESHOLD):
+    """Check if the image is in focus based on the focus measure."""
+    return focus_measure > focus_threshold
+
+def analyse_image(file_path, scale=1, **options):
+    """Read an image and return its white balance and focus results, or None if it cannot be read.
+
+    options are passed to analyse_decoded.
+    """
+    image = read_image(file_path, scale)
+    if image is None:
+        return None
+    return analyse_decoded(image, file_path, scale, **options)
+
+def analyse_decoded(image, file_path=None, scale=1, focus_threshold=DEFAULT_FOCUS_THRESHOLD,
+                    wb_threshold=DEFAULT_WB_THRESHOLD, grey_card=None, grey_card_threshold=DEFAULT_GREY_CARD_THRESHOLD,
+                    focus_tiles=None, focus_early_exit=False, heatmap_dir=None, scratch=_scratch):
+    """Return the white balance and focus results of an image already decoded at 1/scale resolution.
+
+    grey_card is the session's card ROI, or True to locate the card in this image. If the ROI no longer shows the
+    card it is located again and the new ROI is used for the following images in this process; the ROI used is
+    returned so it can be cached. Without a card the whole frame is used.
+
+    focus_tiles is a tile size in full resolution pixels and turns on the tiled focus check: each tile is held to
+    focus_threshold and the soft tiles with content are counted. With focus_early_exit the scan stops once enough
+    tiles are sharp and the soft tiles are not counted. heatmap_dir gets a focus heatmap of every image (and always
+    scans the whole sheet), named after file_path. Threads measuring images at the same time each need their own
+    MetricScratch.
+    """
+    metrics = measure_image(image, focus=not focus_tiles, scratch=scratch)
+    roi = None
+    if grey_card is not None:
+        # Once the card has been found somewhere else, later images start from there rather than the session ROI
+        current = _moved_grey_cards.get(grey_card, grey_card)
+        roi = current if current is not True and is_grey_card(image, current) else locate_grey_card(image)
+        if roi is not None and roi != current:
+            _moved_grey_cards[grey_card] = roi
+    if roi is not None:
+        white_balance = grey_card_means(image, roi)
+        white_balanced = is_white_balanced(white_balance, grey_card_threshold)
+    else:
+        white_balance = metrics.means
+        white_balanced = is_white_balanced(white_balance, wb_threshold)
+
+    soft_tiles = None
+    if focus_tiles:
+        early_exit = focus_early_exit and heatmap_dir is None
+        focus_map = tile_focus(scratch.gray, max(MIN_TILE_SIZE, focus_tiles // scale), focus_threshold,
+                               MIN_SHARP_TILES if early_exit else None)
+        focus, in_focus, soft_tiles = focus_verdict(focus_map, focus_threshold)
+        if early_exit:
+            soft_tiles = None
+        if heatmap_dir is not None:
+            save_heatmap(focus_map, heatmap_path_for(heatmap_dir, file_path), focus_threshold)
+    else:
+        focus = metrics.focus
+        in_focus = is_in_focus(focus, focus_threshold)
+    return {
+        'White Balance (R,G,B)': white_balance,
+        'Focus Measure': focus,
+        'In Focus': in_focus,
+        'White Balanced': white_balanced,
+        'White Balance Source': 'grey card' if roi is not None else 'full frame',
+        'Grey Card ROI': roi,
+        'Soft Tiles': soft_tiles,
+        'Clipped Shadows': metrics.clipped_shadows,
+        'Clipped Highlights': metrics.clipped_highlights,
+    }
@@ -0,0 +1,234 @@
+### Staged QC pipeline for the Alliance/Picturae check.
+### The sequential flow compares every file, then validates every file, then runs the pixel checks on every file:
+### nothing is reported until the last phase starts, and the disks sit idle while the CPUs work and the other way
+### round. Here each file goes through list -> read -> hash -> decode -> metrics -> route -> report on its own.
+### The stages are asyncio coroutines joined by bounded queues, so reads only run ahead of the CPU stages as far
+### as the queues allow and memory stays bounded while I/O and CPU overlap; throughput approaches that of the
+### slowest stage rather than the sum of all of them. Reading and hashing run on an I/O thread pool, decoding and
+### the metrics on a CPU thread pool (OpenCV and hashlib release the GIL), each stage with its own concurrency.
+### Each file is read once: the same bytes are hashed, structure checked and decoded (see image_pipeline).
+### Rows are written in filename order, each as soon as every earlier file is done.
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from dir_snapshot import DirectorySnapshot
+from hash_engine import hash_file
+from image_pipeline import decode_image
+from image_structure import check_structure_bytes, DECODABLE_EXTENSIONS
+from raw_preview import is_raw_file
+from qc_engine import DEFAULT_WORKERS
+from qc_metrics import analyse_decoded, load_thresholds, MetricScratch, REDUCED_DECODE_FLAGS
+
+FILE_TYPES = ('.jpg', '.jpeg', '.dng', '.cr2', '.tif', '.tiff')
+FILENAME_PATTERN = re.compile(r'^(V\d{7}F|C\d{7}F)\.(jpg|jpeg|dng|cr2|tif|tiff)$', re.IGNORECASE)
+DEFAULT_IO_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 8  # Files waiting between two stages; bounds the image data held in memory
+STAGES = ['read', 'hash', 'decode', 'metrics', 'route', 'report']
+
+_DONE = object()
+
+def is_valid_file_type(filename):
+    return filename.lower().endswith(FILE_TYPES)
+
+class QCPipeline:
+    """Compares dir1 with dir2 and QCs every file of dir1, streaming the comparison and QC rows to their reports.
+
+    Files failing a check are added to mover, as in the sequential flow. analysis_options are passed on to
+    qc_metrics.analyse_decoded (grey card, tiled focus, heatmaps).
+    """
+
+    def __init__(self, dir1, dir2, comparison_report, qc_report, mover, cache=None, workers=DEFAULT_WORKERS,
+                 io_workers=DEFAULT_IO_WORKERS, scale=1, deep=False, queue_size=DEFAULT_QUEUE_SIZE,
+                 analysis_options=None):
+        self.dir1 = dir1
+        self.dir2 = dir2
+        self.comparison_report = comparison_report
+        self.qc_report = qc_report
+        self.mover = mover
+        self.cache = cache
+        self.workers = workers
+        self.io_workers = io_workers
+        self.scale = scale
+        self.deep = deep
+        self.queue_size = queue_size
+        focus_threshold, wb_threshold = load_thresholds(scale)
+        self.analysis_options = {'focus_threshold': focus_threshold, 'wb_threshold': wb_threshold,
+                                 **(analysis_options or {})}
+        self.identical = True
+        self.dir1_files = []
+        self.snapshot2 = None
+        self.seconds = 0.0
+        self.busy = dict.fromkeys(STAGES, 0.0)  # Seconds each stage spent working, to spot the bottleneck
+        self.files = 0
+        self.grey_card_roi = None  # Grey card ROI of the last image measured on the card, to update the cache
+        self._finished = {}
+        self._next_index = 0
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _md5(self, file_path, data=None, st=None):
+        """MD5 of a file through the hash cache; the cache itself is only touched under the lock."""
+        if data is not None:
+            md5 = hashlib.md5(data).hexdigest()
+        else:
+            st = os.stat(file_path)
+            if self.cache is not None:
+                with self._cache_lock:
+                    md5 = self.cache.lookup(file_path, st)
+                if md5 is not None:
+                    return md5
+            md5 = hash_file(file_path)
+        if self.cache is not None:
+            with self._cache_lock:
+                self.cache.store(file_path, md5, st)
+        return md5
+
+    # Stage functions: each takes a file's item dict and returns it, run on an executor unless noted
+
+    def read(self, item):
+        with open(item['path'], 'rb') as f:
+            item['stat'] = os.fstat(f.fileno())
+            item['data'] = f.read()
+        return item
+
+    def hash(self, item):
+        """MD5 of both copies, the filename check and the structural corruption check."""
+        filename = item['filename']
+        item['md5'] = self._md5(item['path'], item['data'], item['stat'])
+        item['picturae_md5'] = (self._md5(os.path.join(self.dir2, filename))
+                                if self.snapshot2.is_file(filename) else None)
+        item['valid_filename'] = FILENAME_PATTERN.match(filename) is not None
+        item['corrupted'] = check_structure_bytes(item['data']) is not None
+        return item
+
+    def decode(self, item):
+        data, item['data'] = item['data'], None
+        if item['corrupted'] or not item['valid_filename']:
+            return item  # Files failing the first checks skip the image checks, as in the sequential flow
+        item['image'] = decode_image(data, REDUCED_DECODE_FLAGS[self.scale], raw=is_raw_file(item['path']))
+        if item['image'] is None and self.deep and item['path'].lower().endswith(DECODABLE_EXTENSIONS):
+            item['corrupted'] = True
+        return item
+
+    def metrics(self, item):
+        image = item.pop('image', None)
+        if image is not None:
+            scratch = getattr(self._local, 'scratch', None)
+            if scratch is None:
+                scratch = self._local.scratch = MetricScratch()
+            analysis = analyse_decoded(image, item['path'], self.scale, scratch=scratch, **self.analysis_options)
+            item['white_balanced'] = bool(analysis['White Balanced'])
+            item['in_focus'] = bool(analysis['In Focus'])
+            if analysis['Grey Card ROI'] is not None:
+                self.grey_card_roi = analysis['Grey Card ROI']
+        return item
+
+    def route(self, item):
+        """Plan the move into errors/ for files failing any check (on the event loop)."""
+        if (item['corrupted'] or not item['valid_filename'] or item.get('white_balanced') is False
+                or item.get('in_focus') is False):
+            self.mover.add(item['path'], os.path.join(self.dir1, 'errors', item['filename']))
+        return item
+
+    def report(self, item):
+        """Hold finished files until every earlier one is done, then write their rows (on the event loop)."""
+        self._finished[item['index']] = item
+        while self._next_index in self._finished:
+            self._write(self._finished.pop(self._next_index))
+            self._next_index += 1
+
+    def _write(self, item):
+        filename = item['filename']
+        if item.get('failed'):
+            print(f"Could not check {filename}: {item['failed']}")
+        if not self.snapshot2.is_file(filename):
+            self.identical = False
+            self.comparison_report.append({'Filename': filename, 'MD5 Match': False, 'Not Found In': 'Picturae'})
+        else:
+            md5_match = item['md5'] is not None and item['md5'] == item['picturae_md5']
+            self.identical = self.identical and md5_match
+            self.comparison_report.append({'Filename': filename, 'MD5 Match': md5_match})
+        self.qc_report.append({'Filename': filename, 'Valid Filename': item['valid_filename'],
+                               'Corrupted': item['corrupted'], 'White Balanced': item.get('white_balanced'),
+                               'In Focus': item.get('in_focus')})
+
+    async def _list(self, outbox, executor):
+        """Snapshot both directories and feed dir1's files into the pipeline in filename order."""
+        loop = asyncio.get_running_loop()
+        snapshot1, self.snapshot2 = await asyncio.gather(loop.run_in_executor(executor, DirectorySnapshot, self.dir1),
+                                                         loop.run_in_executor(executor, DirectorySnapshot, self.dir2))
+        self.dir1_files = sorted(snapshot1.files(is_valid_file_type))
+        for index, filename in enumerate(self.dir1_files):
+            await outbox.put({'index': index, 'filename': filename, 'path': snapshot1.path(filename),
+                              'md5': None, 'picturae_md5': None, 'valid_filename': False, 'corrupted': True})
+        await outbox.put(_DONE)
+
+    async def _stage(self, name, inbox, outbox, concurrency, executor=None):
+        """Run a stage with concurrency workers taking items from inbox, until the end of the input."""
+        loop = asyncio.get_running_loop()
+        func = getattr(self, name)
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    await inbox.put(_DONE)  # Let the stage's other workers see the end too
+                    return
+                start = time.perf_counter()
+                if not item.get('failed'):
+                    try:
+                        item = await loop.run_in_executor(executor, func, item) if executor else func(item)
+                    except Exception as e:
+                        # An unreadable file is reported like a corrupted one and skips the remaining checks
+                        item.update(failed=f"{name}: {e}", corrupted=True, data=None, image=None)
+                self.busy[name] += time.perf_counter() - start
+                if outbox is not None:
+                    await outbox.put(item)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        if outbox is not None:
+            await outbox.put(_DONE)
+
+    async def _run(self):
+        queues = [asyncio.Queue(self.queue_size) for _ in STAGES]
+        with ThreadPoolExecutor(self.io_workers * 2) as io_pool, ThreadPoolExecutor(self.workers) as cpu_pool:
+            await asyncio.gather(
+                self._list(queues[0], io_pool),
+                self._stage('read', queues[0], queues[1], self.io_workers, io_pool),
+                self._stage('hash', queues[1], queues[2], self.io_workers, io_pool),
+                self._stage('decode', queues[2], queues[3], self.workers, cpu_pool),
+                self._stage('metrics', queues[3], queues[4], self.workers, cpu_pool),
+                self._stage('route', queues[4], queues[5], 1),
+                self._stage('report', queues[5], None, 1),
+            )
+
+    def run(self):
+        """Run the pipeline over every file. Returns True if both directories hold identical files."""
+        start = time.perf_counter()
+        # Images are processed side by side on the thread pools, so OpenCV should not start threads of its own
+        threads = cv2.getNumThreads()
+        cv2.setNumThreads(1)
+        try:
+            asyncio.run(self._run())
+        finally:
+            cv2.setNumThreads(threads)
+        self.seconds = time.perf_counter() - start
+
+        dir1_files = set(self.dir1_files)
+        for filename in sorted(self.snapshot2.files(is_valid_file_type)):
+            if filename not in dir1_files:
+                self.identical = False
+                self.comparison_report.append({'Filename': filename, 'MD5 Match': False, 'Not Found In': 'Alliance'})
+        self.files = len(self.dir1_files)
+        return self.identical
+
+    def stats(self):
+        """Return a one line summary of the run with the busy time of each stage."""
+        stages = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in self.busy.items())
+        return f"Checked {self.files} files in {self.seconds:.1f}s (stage busy time: {stages})"
@@ -0,0 +1,84 @@
+### Per-file QC report keyed by filename.
+### Each stage (comparison, MD5 conflicts, filename validation, corruption, pixel QC) merges its rows into a single
+### row per file through a dict lookup, replacing linear scans over the other stage's list. A barcode index groups
+### the files that belong to one specimen (e.g. V0507989F.jpg and V0507989F.dng).
+
+import os
+from report_writer import ReportWriter
+
+def barcode_of(filename):
+    """Return the barcode part of a filename, e.g. V0507989F.dng -> V0507989F."""
+    return os.path.splitext(filename)[0]
+
+class QCReport:
+    """One row per file, merged across stages. Columns are kept in the order they first appear."""
+
+    def __init__(self, fieldnames=('Filename',)):
+        self.fieldnames = list(fieldnames)
+        self.rows = {}
+        self.barcodes = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, filename):
+        return filename in self.rows
+
+    def __iter__(self):
+        return iter(self.rows.values())
+
+    def get(self, filename):
+        return self.rows.get(filename)
+
+    def for_barcode(self, barcode):
+        """Return the rows of every file with the given barcode."""
+        return [self.rows[filename] for filename in self.barcodes.get(barcode, ())]
+
+    def merge(self, filename, values):
+        """Merge a stage's values into the row for filename. None never overwrites a value another stage set."""
+        row = self.rows.get(filename)
+        if row is None:
+            row = self.rows[filename] = {'Filename': filename}
+            self.barcodes.setdefault(barcode_of(filename), []).append(filename)
+        for key, value in values.items():
+            if key not in self.fieldnames:
+                self.fieldnames.append(key)
+            if value is not None or key not in row:
+                row[key] = value
+        return row
+
+    def append(self, row):
+        """Merge a row that carries its own 'Filename', so the report can stand in for a stage's row list."""
+        self.merge(row['Filename'], {key: value for key, value in row.items() if key != 'Filename'})
+
+    def tee(self, output, columns=None):
+        """Return a stage report that appends rows to output and also merges them here.
+
+        columns renames stage fields in the merged report, e.g. {'Reason': 'Corruption'}.
+        """
+        return StageReport(self, output, columns or {})
+
+    def save(self, path):
+        """Write the merged report, one row per file."""
+        with ReportWriter(path, self.fieldnames) as writer:
+            for row in self.rows.values():
+                writer.append(row)
+
+class StageReport:
+    """A stage's own report (a list or ReportWriter) whose rows are also merged into a QCReport."""
+
+    def __init__(self, qc_report, output, columns):
+        self.qc_report = qc_report
+        self.output = output
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.output)
+
+    def append(self, row):
+        self.output.append(row)
+        self.qc_report.append({self.columns.get(key, key): value for key, value in row.items()})
+
+    def close(self):
+        if hasattr(self.output, 'close'):
+            self.output.close()
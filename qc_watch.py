@@ -0,0 +1,323 @@
+### Watch folder QC daemon.
+### Runs alongside the imaging and checks each capture as it lands in the Alliance intake folder, instead of waiting
+### for the whole shipment and a manual run. Filesystem events (watchdog: inotify on Linux, ReadDirectoryChangesW on
+### Windows) wake it up when something changes and only the files they name are looked at, with a full listing now
+### and then for anything missed; without watchdog, or on shares that do not deliver events, the folder is polled.
+### A file is only taken once its size and mtime have stayed the same for a settle period, so half written files
+### are left alone. Settled files are hashed and QC'd on a process pool, each read once (see
+### image_pipeline), and each result is appended to the watch report straight away. Their MD5s go into the shared
+### hash cache, merged into the copy on disk at each save since the scheduled runs write it too, so the later
+### comparison runs do not read them again. The scan watermark records them so a restart carries on where it stopped.
+
+import os
+import re
+import stat
+import time
+import signal
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dir_snapshot import DirectorySnapshot
+from scan_watermark import ScanWatermark
+from hash_cache import HashCache, DEFAULT_CACHE_PATH
+from image_pipeline import read_and_hash, decode_image
+from image_structure import check_structure_bytes, DECODABLE_EXTENSIONS
+from raw_preview import is_raw_file
+from qc_engine import DEFAULT_WORKERS, _init_worker
+from qc_metrics import analyse_decoded, load_thresholds, REDUCED_DECODE_FLAGS
+from report_writer import ReportWriter
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Polling only
+    Observer = None
+    FileSystemEventHandler = object
+
+# Separate from the scheduled runs' watermark: files checked here still have to go through the full comparison
+DEFAULT_WATERMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qc_watch_watermark.json')
+WATCH_EXTENSIONS = ('.jpg', '.jpeg', '.dng', '.cr2', '.tif', '.tiff')
+FILENAME_PATTERN = re.compile(r'^[VC]\d{7}F\.(jpg|jpeg|dng|cr2|tif|tiff)$', re.IGNORECASE)
+DEFAULT_SETTLE_SECONDS = 5.0     # Unchanged size and mtime for this long means the file is complete
+DEFAULT_POLL_SECONDS = 2.0       # Rescan interval when polling
+EVENT_RESCAN_SECONDS = 60.0      # Rescan interval with events, for anything the events missed
+SAVE_SECONDS = 30.0              # Longest time processed files go without being saved to the watermark
+WATCH_FIELDS = ['Filename', 'Received', 'MD5', 'Valid Filename', 'Corrupted', 'Corruption Reason', 'White Balanced',
+                'In Focus', 'Focus Measure', 'Latency (s)']
+
+def is_watched(filename):
+    return filename.lower().endswith(WATCH_EXTENSIONS)
+
+def qc_file(file_path, scale=1, focus_threshold=None, wb_threshold=None):
+    """Hash and QC one file in a worker process. Returns its report row without the timing columns."""
+    # The same bytes are hashed, structure checked and decoded
+    data, md5 = read_and_hash(file_path)
+    reason = check_structure_bytes(data)
+    image = None
+    if reason is None:
+        image = decode_image(data, REDUCED_DECODE_FLAGS[scale], raw=is_raw_file(file_path))
+        if image is None and file_path.lower().endswith(DECODABLE_EXTENSIONS):
+            reason = "Could not be decoded"
+    row = {
+        'Filename': os.path.basename(file_path),
+        'MD5': md5,
+        'Valid Filename': FILENAME_PATTERN.match(os.path.basename(file_path)) is not None,
+        'Corrupted': reason is not None,
+        'Corruption Reason': reason,
+    }
+    if image is not None:
+        analysis = analyse_decoded(image, file_path, scale, focus_threshold=focus_threshold, wb_threshold=wb_threshold)
+        row['White Balanced'] = analysis['White Balanced']
+        row['In Focus'] = analysis['In Focus']
+        row['Focus Measure'] = analysis['Focus Measure']
+    return row
+
+class StableFiles:
+    """Files waiting for their size and mtime to stop changing."""
+
+    def __init__(self, directory, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.directory = directory
+        self.settle_seconds = settle_seconds
+        self.pending = {}  # {filename: (signature, time it was first seen with that signature)}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, name):
+        return name in self.pending
+
+    def note(self, name, signature, now):
+        """Start (or restart) the settle period of a file, unless it is already waiting with this signature."""
+        if name not in self.pending or self.pending[name][0] != signature:
+            self.pending[name] = (signature, now)
+
+    def ready(self, now):
+        """Re-stat the waiting files and return {filename: signature} for those that have settled.
+
+        Files that changed start their settle period again; files that disappeared are dropped.
+        """
+        settled = {}
+        for name, (signature, since) in list(self.pending.items()):
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            current = [st.st_size, st.st_mtime_ns]
+            if current != signature:
+                self.pending[name] = (current, now)
+            elif now - since >= self.settle_seconds:
+                settled[name] = signature
+                del self.pending[name]
+        return settled
+
+class _Wakeup(FileSystemEventHandler):
+    """Collects the paths named by filesystem events in the folder and wakes the watcher's loop."""
+
+    def __init__(self, event):
+        self.event = event
+        self.lock = threading.Lock()
+        self.paths = set()
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            with self.lock:
+                self.paths.add(event.src_path)
+                if getattr(event, 'dest_path', None):  # Moves and renames
+                    self.paths.add(event.dest_path)
+        self.event.set()
+
+    def take(self):
+        """Return the paths collected since the last call."""
+        with self.lock:
+            paths, self.paths = self.paths, set()
+        return paths
+
+def _stop(signum, frame):
+    # Service managers stop the daemon with SIGTERM; shut down the same way as on Ctrl+C
+    raise KeyboardInterrupt
+
+def _init_watch_worker():
+    _init_worker()
+    # Ctrl+C and SIGTERM reach the whole process group; workers finish their file and the daemon shuts them down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+class QCWatcher:
+    """Watches one folder and QCs every file once it has settled."""
+
+    def __init__(self, folder, report, watermark, cache_path=None, workers=DEFAULT_WORKERS, scale=1,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, use_events=True):
+        self.folder = folder
+        self.report = report
+        self.watermark = watermark
+        self.cache_path = cache_path
+        self.workers = workers
+        self.scale = scale
+        self.stable = StableFiles(folder, settle_seconds)
+        self.use_events = use_events and Observer is not None
+        self.poll_seconds = EVENT_RESCAN_SECONDS if self.use_events else poll_seconds
+        self.wakeup = threading.Event()
+        self.events = _Wakeup(self.wakeup)
+        self.in_flight = {}   # {future: (filename, signature)}
+        self.processed = {}   # {filename: signature} for files done but not yet saved to the watermark
+        self.digests = {}     # {file path: (md5, stat)} for files done but not yet saved to the hash cache
+        self.files_checked = 0
+
+    def scan(self, now):
+        """List the folder and start the settle period of every new or changed file."""
+        signatures = DirectorySnapshot(self.folder).signatures(is_watched)
+        self.watermark.forget_missing(self.folder, signatures)
+        self._note(signatures, now)
+
+    def check_paths(self, paths, now):
+        """Stat the files named by filesystem events and start the settle period of the new or changed ones."""
+        folder = os.path.abspath(self.folder)
+        signatures = {}
+        for path in paths:
+            name = os.path.basename(path)
+            if os.path.dirname(os.path.abspath(path)) != folder or not is_watched(name):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Deleted or moved away again
+            if stat.S_ISREG(st.st_mode):
+                signatures[name] = [st.st_size, st.st_mtime_ns]
+        self._note(signatures, now)
+
+    def _note(self, signatures, now):
+        """Start the settle period of the files in {filename: signature} not yet checked at that signature."""
+        busy = {name for name, _ in self.in_flight.values()}
+        for name in self.watermark.changed_files(self.folder, signatures):
+            if name not in busy and self.processed.get(name) != signatures[name]:
+                self.stable.note(name, signatures[name], now)
+
+    def collect(self, done):
+        """Write the report rows of finished files and cache their MD5s."""
+        for future in done:
+            name, signature = self.in_flight.pop(future)
+            file_path = os.path.join(self.folder, name)
+            try:
+                row = future.result()
+            except Exception as e:
+                # Reported like a corrupted file, and not tried again until the file changes
+                print(f"Error checking {name}: {e}")
+                row = {'Filename': name, 'MD5': None, 'Valid Filename': FILENAME_PATTERN.match(name) is not None,
+                       'Corrupted': True, 'Corruption Reason': f"Could not be checked: {e}"}
+            row['Received'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(signature[1] / 1e9))
+            row['Latency (s)'] = round(time.time() - signature[1] / 1e9, 1)
+            self.report.append(row)
+            self.files_checked += 1
+            self.processed[name] = signature
+            print(f"{name}: {'OK' if self._passed(row) else 'FAILED'} ({row['Latency (s)']}s after landing)")
+
+            # Only cache the digest if the file is still the one that was hashed
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            if self.cache_path is not None and row['MD5'] is not None and [st.st_size, st.st_mtime_ns] == signature:
+                self.digests[file_path] = (row['MD5'], st)
+
+    @staticmethod
+    def _passed(row):
+        return (row['Valid Filename'] and not row['Corrupted'] and row.get('White Balanced') is not False
+                and row.get('In Focus') is not False)
+
+    def save(self):
+        """Record the processed files in the watermark and save it and the hash cache."""
+        if self.processed:
+            # Files that changed after being checked no longer match and are picked up again
+            self.watermark.mark_files_seen(self.folder, self.processed)
+            self.watermark.save()
+            self.processed = {}
+        if self.digests:
+            # The scheduled runs save the same cache file while the daemon runs: load it afresh so their entries
+            # are kept, rather than overwriting them with the copy from startup
+            cache = HashCache(self.cache_path)
+            for file_path, (md5, st) in self.digests.items():
+                cache.store(file_path, md5, st)
+            cache.save()
+            self.digests = {}
+
+    def run(self, once=False):
+        """Watch until interrupted, or with once until every file present at the start has been checked."""
+        focus_threshold, wb_threshold = load_thresholds(self.scale)
+        observer = None
+        if self.use_events and not once:
+            observer = Observer()
+            observer.schedule(self.events, self.folder, recursive=False)
+            observer.start()
+        print(f"Watching {self.folder} ({'events' if observer else 'polling'}, "
+              f"files settle after {self.stable.settle_seconds:g}s)")
+
+        next_scan = 0.0
+        next_save = time.monotonic() + SAVE_SECONDS
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_watch_worker)
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= next_scan:
+                    self.wakeup.clear()
+                    self.events.take()  # The listing covers them
+                    self.scan(now)
+                    next_scan = float('inf') if once else now + self.poll_seconds
+                elif self.wakeup.is_set():
+                    self.wakeup.clear()
+                    self.check_paths(self.events.take(), now)
+
+                for name, signature in self.stable.ready(now).items():
+                    future = pool.submit(qc_file, os.path.join(self.folder, name), self.scale, focus_threshold,
+                                         wb_threshold)
+                    self.in_flight[future] = (name, signature)
+
+                # Wake for finished files, filesystem events, settling files and the next rescan, whichever is first
+                timeout = min(next_scan - now, self.stable.settle_seconds / 2 if self.stable else self.poll_seconds)
+                if self.in_flight:
+                    done, _ = wait(list(self.in_flight), timeout=max(timeout, 0.1), return_when=FIRST_COMPLETED)
+                    self.collect(done)
+                else:
+                    self.wakeup.wait(max(timeout, 0.1))
+
+                # Saving rewrites the whole hash cache, so it is batched rather than done per file
+                if now >= next_save:
+                    self.save()
+                    next_save = now + SAVE_SECONDS
+                if once and not self.stable and not self.in_flight:
+                    break
+        except KeyboardInterrupt:
+            print("Stopping, waiting for files being checked...")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            pool.shutdown(wait=True)
+            self.collect([future for future in list(self.in_flight) if future.done()])
+            self.save()
+        return self.files_checked
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hash and QC every image as soon as it lands in the intake folder.")
+    parser.add_argument('folder', help="Alliance intake folder to watch")
+    parser.add_argument('--report-dir', help="Folder for the watch reports (defaults to qc_watch in the folder)")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a file's size and mtime must stay unchanged before it is checked")
+    parser.add_argument('--poll', type=float, default=DEFAULT_POLL_SECONDS, help="Polling interval in seconds")
+    parser.add_argument('--polling', action='store_true', help="Poll even if filesystem events are available")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of QC worker processes")
+    parser.add_argument('--scale', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=1,
+                        help="Decode images at 1/scale resolution for the QC metrics")
+    parser.add_argument('--once', action='store_true', help="Check the files already there, then exit")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGTERM, _stop)
+    if Observer is None and not args.polling:
+        print("watchdog is not installed; polling the folder instead (pip install watchdog for events)")
+    report_dir = args.report_dir or os.path.join(args.folder, 'qc_watch')
+    report_path = os.path.join(report_dir, f"watch_report_{time.strftime('%Y%m%d_%H%M%S')}.csv")
+    with ReportWriter(report_path, WATCH_FIELDS) as report:
+        watcher = QCWatcher(args.folder, report, ScanWatermark(DEFAULT_WATERMARK_PATH), DEFAULT_CACHE_PATH,
+                            args.workers, args.scale, args.settle, args.poll, use_events=not args.polling)
+        checked = watcher.run(args.once)
+    print(f"Checked {checked} files. Report saved to {report_path}")
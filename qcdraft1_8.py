@@ -16,19 +16,35 @@
 
 
 import os
-import hashlib
-import pandas as pd
-import shutil
 import re
-import cv2  # Import OpenCV for image validation
-
-def calculate_md5(file_path):
-    """Calculate the MD5 hash of a file."""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+import argparse
+from image_structure import check_corruption
+from hash_cache import HashCache, DEFAULT_CACHE_PATH
+from hash_engine import HashEngine, hash_file, copy_and_hash, DEFAULT_WORKERS
+from report_writer import ReportWriter, write_summary
+from scan_watermark import ScanWatermark, DEFAULT_WATERMARK_PATH
+from qc_report import QCReport
+from dir_snapshot import DirectorySnapshot
+from checksum_manifest import ChecksumManifest, find_manifest
+from file_pairing import check_pairs
+from file_mover import MovePlan, journal_path_for, recover_pending
+
+# Fixed report columns, so rows can be streamed to CSV as they are produced
+COMPARISON_FIELDS = ['Filename', 'MD5 Hash 1', 'MD5 Hash 2', 'Match', 'Decided By', 'Error']
+ERROR_FIELDS = ['Filename', 'Reason']
+COPY_FIELDS = ['Filename', 'Source', 'MD5', 'SHA-256', 'Verified']
+
+# How far compare_directories goes before trusting that two files match. Each tier only looks at the files the
+# previous one could not tell apart: size (from the directory listing), partial (digest of the first and last
+# 64 KB) and full (MD5 of the whole file).
+TRUST_LEVELS = ['size', 'partial', 'full']
+QC_REPORT_FIELDS = COMPARISON_FIELDS + ['MD5 Error', 'Filename Error', 'Corruption', 'Pairing']
+
+def calculate_md5(file_path, engine=None):
+    """Calculate the MD5 hash of a file, through the hashing engine if one is given."""
+    if engine is not None:
+        return engine.md5(file_path)
+    return hash_file(file_path)
 
 def is_valid_file_type(filename):
     """Check if the file type is among the specified types."""
@@ -39,111 +55,283 @@ def is_valid_filename(filename):
     """Check if the filename adheres to the naming convention."""
     return bool(re.match(r'^[VC]\d{7}F$', filename[:-4]))  # Exclude the file extension
 
-def is_image_corrupted(file_path):
-    """Check if the image is corrupted or unreadable."""
-    image = cv2.imread(file_path)
-    return image is None
-
-def compare_directories(dir1, dir2):
-    """Compare image files in two directories."""
-    report = []
+def compare_directories(dir1, dir2, engine=None, report=None, only=None, snapshot1=None, snapshot2=None,
+                        trust_level='full', manifest=None):
+    """Compare image files in two directories.
+
+    Rows are appended to report as each file is compared; pass a ReportWriter to stream them to disk.
+    only restricts the comparison to a set of filenames, for incremental runs.
+    snapshot1/snapshot2 are the run's DirectorySnapshots of dir1/dir2; they are taken here if not given.
+    Files are compared by existence, size, partial digest and full MD5 in turn, stopping at the first tier that
+    finds a difference or at trust_level. 'Decided By' in each row names the tier that settled it.
+    manifest is the vendor's ChecksumManifest for dir2; at the full tier the files it lists are checked against it
+    and their dir2 copies are never read.
+    """
+    if report is None:
+        report = []
     unmatched_files = []
 
-    all_files_dir1 = os.listdir(dir1)
-    all_files_dir2 = os.listdir(dir2)
+    if snapshot1 is None:
+        snapshot1 = DirectorySnapshot(dir1)
+    if snapshot2 is None:
+        snapshot2 = DirectorySnapshot(dir2)
 
-    files_dir1 = {f: os.path.join(dir1, f) for f in all_files_dir1 if is_valid_file_type(f)}
-    files_dir2 = {f: os.path.join(dir2, f) for f in all_files_dir2 if is_valid_file_type(f)}
+    files_dir1 = {f: snapshot1.path(f) for f in snapshot1.files(is_valid_file_type)}
+    files_dir2 = {f: snapshot2.path(f) for f in snapshot2.files(is_valid_file_type)}
+    if only is not None:
+        files_dir1 = {f: path for f, path in files_dir1.items() if f in only}
+        files_dir2 = {f: path for f, path in files_dir2.items() if f in only}
 
     identical = True  # Flag to check if directories are identical
 
-    for filename, path1 in files_dir1.items():
-        if filename in files_dir2:
-            path2 = files_dir2[filename]
-
-            md5_hash1 = calculate_md5(path1)
-            md5_hash2 = calculate_md5(path2)
+    if engine is None:
+        engine = HashEngine()
+    levels = TRUST_LEVELS[:TRUST_LEVELS.index(trust_level) + 1]
+    reference = manifest.known_for(files_dir2) if manifest is not None and levels[-1] == 'full' else {}
 
-            match = md5_hash1 == md5_hash2
-            report.append({'Filename': filename, 'MD5 Hash 1': md5_hash1, 'MD5 Hash 2': md5_hash2, 'Match': match})
-
-            if not match:
-                identical = False
-                unmatched_files.append(filename)  # Log the unmatched file
-                report[-1]['Error'] = 'MD5 hash mismatch'
-        else:
+    def decide(filename, match, tier, error, md5_1=None, md5_2=None):
+        # Write a file's row as soon as a tier settles it
+        nonlocal identical
+        row = {'Filename': filename, 'MD5 Hash 1': md5_1, 'MD5 Hash 2': md5_2, 'Match': match, 'Decided By': tier}
+        if not match:
+            identical = False
+            unmatched_files.append(filename)  # Log the unmatched file
+            row['Error'] = error
+        report.append(row)
+
+    # Existence and size come free with the snapshots
+    candidates = []
+    for filename in files_dir1:
+        if filename not in files_dir2:
             identical = False
             unmatched_files.append(filename)  # Log the missing file
-            report.append({'Filename': filename, 'Error': 'Not found in second directory'})
+            report.append({'Filename': filename, 'Decided By': 'existence', 'Error': 'Not found in second directory'})
+        elif snapshot1.entries[filename].size != snapshot2.entries[filename].size:
+            decide(filename, False, 'size', 'Size mismatch')
+        elif levels[-1] == 'size':
+            decide(filename, True, 'size', None)
+        else:
+            candidates.append(filename)
 
-    for filename in files_dir2.keys():
+    for filename in files_dir2:
         if filename not in files_dir1:
             identical = False
-            report.append({'Filename': filename, 'Error': 'Not found in first directory'})
+            report.append({'Filename': filename, 'Decided By': 'existence', 'Error': 'Not found in first directory'})
+
+    # Partial digests of the files whose sizes agree, read from both sides in parallel.
+    # Files listed in the manifest, or with both full MD5s already cached, skip straight to the full tier.
+    if 'partial' in levels and candidates:
+        survivors = []
+        if levels[-1] == 'full':
+            cached = {f for f in candidates if f in reference
+                      or (engine.cached_md5(files_dir1[f]) and engine.cached_md5(files_dir2[f]))}
+            survivors = [f for f in candidates if f in cached]
+            candidates = [f for f in candidates if f not in cached]
+        partials = engine.partial_many([files_dir1[f] for f in candidates] + [files_dir2[f] for f in candidates])
+        for filename in candidates:
+            if partials[files_dir1[filename]] != partials[files_dir2[filename]]:
+                decide(filename, False, 'partial', 'Partial digest mismatch')
+            elif levels[-1] == 'partial':
+                decide(filename, True, 'partial', None)
+            else:
+                survivors.append(filename)
+        candidates = survivors
+
+    # Full MD5 of whatever is left, so the engine can read them in parallel. The dir2 side comes from the
+    # manifest where it lists the file.
+    hashes = engine.md5_many([files_dir1[f] for f in candidates]
+                             + [files_dir2[f] for f in candidates if f not in reference])
+    for filename in candidates:
+        md5_1 = hashes[files_dir1[filename]]
+        md5_2 = reference[filename] if filename in reference else hashes[files_dir2[filename]]
+        tier = 'manifest' if filename in reference else 'full'
+        decide(filename, md5_1 == md5_2, tier, 'MD5 hash mismatch', md5_1, md5_2)
 
     return report, identical, unmatched_files
 
-def handle_file_conflict(target_dir, filename, md5_hash1, md5_hash2, md5_error_report):
-    """Move existing file to the MD5 error folder if it conflicts with a new file."""
-    md5_error_dir = os.path.join(target_dir, 'md5_errors')
-    os.makedirs(md5_error_dir, exist_ok=True)  # Create the MD5 error directory if it doesn't exist
+def handle_file_conflict(target_dir, filename, md5_hash1, md5_hash2, md5_error_report, target_snapshot=None,
+                         mover=None):
+    """Plan moving the existing file to the MD5 error folder if it conflicts with a new file.
 
-    existing_file_path = os.path.join(target_dir, filename)
-    if os.path.exists(existing_file_path):
+    The move is added to mover, or made straight away if no MovePlan is given.
+    """
+    md5_error_dir = os.path.join(target_dir, 'md5_errors')
+    own_plan = mover is None
+    if own_plan:
+        mover = MovePlan(journal_path_for(target_dir))
+
+    if target_snapshot is None:
+        target_snapshot = DirectorySnapshot(target_dir)
+    existing_file_path = target_snapshot.path(filename)
+    if filename in target_snapshot:
         error_reason = f"MD5 hash mismatch: {md5_hash1} vs {md5_hash2}"
-        shutil.move(existing_file_path, os.path.join(md5_error_dir, filename))
+        mover.add(existing_file_path, os.path.join(md5_error_dir, filename))
+        target_snapshot.remove(filename)
         md5_error_report.append({'Filename': filename, 'Reason': error_reason})
-        print(f"Moved existing file to MD5 errors: {filename}")
-
-def copy_unmatched_files(unmatched_files, source_dir, target_dir, md5_error_report):
-    """Copy unmatched files to the target directory with conflict handling."""
+        print(f"Moving existing file to MD5 errors: {filename}")
+
+    if own_plan:
+        mover.execute()
+
+def copy_unmatched_files(unmatched_files, source_dir, target_dir, md5_error_report, engine=None,
+                         source_snapshot=None, target_snapshot=None, copy_manifest=None, sha256=False, reference=None):
+    """Copy unmatched files to the target directory with conflict handling.
+
+    Existence checks go through the directory snapshots, which are updated as files are moved and copied.
+    Conflicting target files are moved to the MD5 error folder in one journaled batch before anything is copied.
+    Files are hashed while they are copied. The copy is verified against the source MD5 when one is already known
+    (from the conflict check or the reference manifest) and removed if it does not match. The digests are cached
+    so the copies are not read again, and each copy is appended to copy_manifest if given.
+    """
+    if source_snapshot is None:
+        source_snapshot = DirectorySnapshot(source_dir)
+    if target_snapshot is None:
+        target_snapshot = DirectorySnapshot(target_dir)
+
+    # Hash both sides of every conflict up front so the engine can read them in parallel
+    if engine is None:
+        engine = HashEngine()
+    conflicts = [f for f in unmatched_files if f in target_snapshot and f in source_snapshot]
+    hashes = engine.md5_many([os.path.join(d, f) for f in conflicts for d in (source_dir, target_dir)])
+
+    # Handle conflicts before copying
+    mover = MovePlan(journal_path_for(target_dir))
+    for filename in conflicts:
+        md5_hash_src = hashes[source_snapshot.path(filename)]
+        md5_hash_target = hashes[target_snapshot.path(filename)]
+        handle_file_conflict(target_dir, filename, md5_hash_src, md5_hash_target, md5_error_report,
+                             target_snapshot, mover)
+    mover.execute()
+
+    algorithms = ('md5', 'sha256') if sha256 else ('md5',)
     for filename in unmatched_files:
-        src = os.path.join(source_dir, filename)
-        if os.path.exists(src):
-            if filename in os.listdir(target_dir):
-                target_file_path = os.path.join(target_dir, filename)
-                md5_hash_src = calculate_md5(src)
-                md5_hash_target = calculate_md5(target_file_path)
-                handle_file_conflict(target_dir, filename, md5_hash_src, md5_hash_target, md5_error_report)  # Handle conflicts before copying
+        src = source_snapshot.path(filename)
+        if filename in source_snapshot:
+            dst = os.path.join(target_dir, filename)
+            expected = hashes.get(src) or (reference.get(filename) if reference is not None else None)
             try:
-                shutil.copy2(src, target_dir)
-                print(f"Copied unmatched file to Alliance: {filename}")
+                before = os.stat(src)
+                digests = copy_and_hash(src, dst, algorithms)
             except Exception as e:
                 print(f"Error copying {filename}: {e}")
-
-def validate_filenames(target_dir, filename_error_report):
-    """Validate filenames in the target directory."""
+                continue
+
+            verified = None if expected is None else digests['md5'] == expected
+            if verified is False:
+                os.remove(dst)
+                print(f"[COPY MISMATCH] {filename}: copied data has MD5 {digests['md5']}, expected {expected}")
+            else:
+                target_snapshot.add(filename)
+                engine.remember(dst, digests['md5'])
+                after = os.stat(src)
+                if (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns):
+                    engine.remember(src, digests['md5'])  # Source did not change while it was being copied
+                print(f"Copied unmatched file to Alliance: {filename}")
+            if copy_manifest is not None:
+                copy_manifest.append({'Filename': filename, 'Source': src, 'MD5': digests['md5'],
+                                      'SHA-256': digests.get('sha256'), 'Verified': verified})
+
+def check_file_pairs(snapshot, qc_report, only=None):
+    """Check that every barcode in the snapshot has a JPG and a DNG and add any issues to the QC report.
+
+    The whole snapshot is grouped so a new file still finds its older partner; only limits which files are
+    reported. Returns the number of files with pairing issues.
+    """
+    issues = check_pairs(snapshot.files(is_valid_file_type))
+    reported = 0
+    for filename, issue in issues.items():
+        if only is None or filename in only:
+            qc_report.merge(filename, {'Pairing': issue})
+            reported += 1
+    return reported
+
+def validate_filenames(target_dir, filename_error_report, only=None, snapshot=None, mover=None):
+    """Validate filenames in the target directory, or only the given set of filenames.
+
+    Moves of invalid files are added to mover, or made at the end if no MovePlan is given.
+    """
     filename_error_dir = os.path.join(target_dir, 'filename_errors')
-    os.makedirs(filename_error_dir, exist_ok=True)  # Create the filename error directory
-
-    for filename in os.listdir(target_dir):
-        if is_valid_file_type(filename) and not is_valid_filename(filename):
-            src_path = os.path.join(target_dir, filename)
+    own_plan = mover is None
+    if own_plan:
+        mover = MovePlan(journal_path_for(target_dir))
+
+    if snapshot is None:
+        snapshot = DirectorySnapshot(target_dir)
+    for filename in snapshot.files(is_valid_file_type):
+        if only is not None and filename not in only:
+            continue
+        if not is_valid_filename(filename):
+            src_path = snapshot.path(filename)
             error_reason = "Invalid filename format"
-            shutil.move(src_path, os.path.join(filename_error_dir, filename))
+            mover.add(src_path, os.path.join(filename_error_dir, filename))
+            snapshot.remove(filename)
             filename_error_report.append({'Filename': filename, 'Reason': error_reason})
-            print(f"Moved invalid filename to errors: {filename}")
+            print(f"Moving invalid filename to errors: {filename}")
 
-def validate_corrupt_images(target_dir, corrupt_report):
-    """Validate images for corruption in the target directory."""
-    corrupt_dir = os.path.join(target_dir, 'corrupt_files')
-    os.makedirs(corrupt_dir, exist_ok=True)  # Create the corrupt files directory if it doesn't exist
+    if own_plan:
+        mover.execute()
 
-    for filename in os.listdir(target_dir):
-        file_path = os.path.join(target_dir, filename)
+def validate_corrupt_images(target_dir, corrupt_report, deep=False, only=None, snapshot=None, mover=None):
+    """Validate images for corruption in the target directory, or only the given set of filenames.
 
-        if os.path.isfile(file_path) and is_valid_file_type(filename):
-            if is_image_corrupted(file_path):
-                corrupt_report.append({'Filename': filename, 'Reason': 'Corrupted or unreadable'})
-                print(f"[CORRUPTED FILE] Found: {filename}")
-                # Move corrupted file to the corrupt files directory
-                shutil.move(file_path, os.path.join(corrupt_dir, filename))
-                print(f"Moved corrupted file to: {filename}")
+    Files are checked structurally without decoding pixels; deep also runs a full decode.
+    Moves of corrupt files are added to mover, or made at the end if no MovePlan is given.
+    """
+    corrupt_dir = os.path.join(target_dir, 'corrupt_files')
+    own_plan = mover is None
+    if own_plan:
+        mover = MovePlan(journal_path_for(target_dir))
+
+    if snapshot is None:
+        snapshot = DirectorySnapshot(target_dir)
+    for filename in snapshot.files(is_valid_file_type):
+        if only is not None and filename not in only:
+            continue
+        file_path = snapshot.path(filename)
+
+        reason = check_corruption(file_path, deep)
+        if reason:
+            corrupt_report.append({'Filename': filename, 'Reason': f'Corrupted or unreadable: {reason}'})
+            print(f"[CORRUPTED FILE] Found: {filename}")
+            # Move corrupted file to the corrupt files directory
+            mover.add(file_path, os.path.join(corrupt_dir, filename))
+            snapshot.remove(filename)
+            print(f"Moving corrupted file to: {filename}")
+
+    if own_plan:
+        mover.execute()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the Alliance and Picturae directories and QC the Alliance copy.")
+    parser.add_argument('--alliance', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance")
+    parser.add_argument('--picturae', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae")
+    parser.add_argument('--hash-cache', default=DEFAULT_CACHE_PATH, help="Persistent MD5 cache file")
+    parser.add_argument('--verify-hashes', action='store_true',
+                        help="Rehash every file and report cached hashes that no longer match")
+    parser.add_argument('--hash-workers', type=int, default=DEFAULT_WORKERS, help="Threads used for hashing")
+    parser.add_argument('--hash-buffer-mb', type=int, default=8, help="Read size per hashing call in MB")
+    parser.add_argument('--mmap', action='store_true', help="Hash through memory maps instead of buffered reads")
+    parser.add_argument('--deep-check', action='store_true',
+                        help="Fully decode images when checking for corruption, not just their file structure")
+    parser.add_argument('--mode', choices=['full', 'incremental'], default='full',
+                        help="full reconciles both directories; incremental only processes files that are new or "
+                             "modified since the last run")
+    parser.add_argument('--watermark', default=DEFAULT_WATERMARK_PATH, help="Scan watermark file for incremental runs")
+    parser.add_argument('--trust-level', choices=TRUST_LEVELS, default='full',
+                        help="Deepest comparison tier: size, partial (first/last 64 KB) or full MD5. Files that "
+                             "agree at this tier are treated as matching")
+    parser.add_argument('--manifest', help="Picturae checksum manifest (CSV, JSON or BagIt manifest-md5.txt) to verify "
+                                           "against instead of reading the Picturae copies. Defaults to a manifest "
+                                           "found in the Picturae directory")
+    parser.add_argument('--sha256', action='store_true',
+                        help="Also compute SHA-256 of copied files for the copy manifest")
+    return parser.parse_args()
 
 def main():
-    dir1 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance"
-    dir2 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae"
-    
+    args = parse_args()
+    dir1 = args.alliance
+    dir2 = args.picturae
+
     if not os.path.exists(dir1):
         print(f"Directory 1 does not exist: {dir1}")
         return
@@ -151,61 +339,114 @@ def main():
         print(f"Directory 2 does not exist: {dir2}")
         return
 
-    md5_error_report = []  # List to hold MD5 error report entries
-    filename_error_report = []  # List to hold filename error report entries
-    corrupt_report = []  # List to hold corrupt file report entries
+    # Finish any moves an interrupted run left half done before looking at the directory
+    recover_pending(dir1)
+
+    # Error reports are streamed into their error folders; each file is only created when its first error is found.
+    # Their rows are also merged with the final comparison into qc_report.csv, one row per file.
+    qc_report = QCReport(QC_REPORT_FIELDS)
+    md5_error_report = qc_report.tee(ReportWriter(os.path.join(dir1, 'md5_errors', 'md5_error_report.csv'),
+                                                  ERROR_FIELDS, lazy=True), {'Reason': 'MD5 Error'})
+    filename_error_report = qc_report.tee(ReportWriter(os.path.join(dir1, 'filename_errors', 'filename_error_report.csv'),
+                                                       ERROR_FIELDS, lazy=True), {'Reason': 'Filename Error'})
+    corrupt_report = qc_report.tee(ReportWriter(os.path.join(dir1, 'corrupt_files', 'corrupt_file_report.csv'),
+                                                ERROR_FIELDS, lazy=True), {'Reason': 'Corruption'})
+    cache = HashCache(args.hash_cache, verify=args.verify_hashes)  # Hashes of unchanged files are reused between runs
+    engine = HashEngine(cache, workers=args.hash_workers, buffer_size=args.hash_buffer_mb * 1024 * 1024,
+                        use_mmap=args.mmap)
+
+    # Incremental (AM/PM) runs only look at files that are new or modified since the last run.
+    # Full runs reconcile everything and rebuild the watermark.
+    # Each directory is listed once; every stage below shares these snapshots and updates them as files move.
+    snapshot1 = DirectorySnapshot(dir1)
+    snapshot2 = DirectorySnapshot(dir2)
+    watermark = ScanWatermark(args.watermark)
+    scan_dir1 = snapshot1.signatures(is_valid_file_type)
+    scan_dir2 = snapshot2.signatures(is_valid_file_type)
+    only = None
+    if args.mode == 'incremental':
+        only = set(watermark.changed_files(dir1, scan_dir1)) | set(watermark.changed_files(dir2, scan_dir2))
+        print(f"Incremental run: {len(only)} new or modified files since {watermark.last_scan(dir1)}")
 
     # First comparison
-    report, identical, unmatched_files = compare_directories(dir1, dir2)
+    # Picturae checksums come from their manifest when one was delivered
+    manifest_path = args.manifest or find_manifest(dir2)
+    manifest = ChecksumManifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        print(f"Verifying against {len(manifest)} checksums from {manifest_path}")
 
-    # Copy unmatched files from dir1 to the Alliance directory
-    copy_unmatched_files(unmatched_files, dir1, dir1, md5_error_report)
-
-    # Copy unmatched files from dir2 to the Alliance directory and re-run the comparison
-    unmatched_files_dir2 = [f for f in os.listdir(dir2) if f not in os.listdir(dir1)]
-    copy_unmatched_files(unmatched_files_dir2, dir2, dir1, md5_error_report)
+    report, identical, unmatched_files = compare_directories(dir1, dir2, engine, only=only, snapshot1=snapshot1,
+                                                             snapshot2=snapshot2, trust_level=args.trust_level,
+                                                             manifest=manifest)
 
-    # Re-run comparison to include unmatched files in dir2
-    report, identical, _ = compare_directories(dir1, dir2)
+    # Every copy made this run is recorded with its digests in the copy manifest
+    copy_manifest = ReportWriter('copy_manifest.csv', COPY_FIELDS, lazy=True)
 
-    # Convert comparison report to DataFrame and save to CSV
-    df = pd.DataFrame(report)
-    df.to_csv('comparison_report.csv', index=False)
-
-    # Save MD5 error report to CSV if there are any errors
-    if md5_error_report:
-        md5_error_df = pd.DataFrame(md5_error_report)
-        md5_error_df.to_csv(os.path.join(dir1, 'md5_errors', 'md5_error_report.csv'), index=False)
-
-    # Validate filenames in the Alliance directory
-    validate_filenames(dir1, filename_error_report)
-
-    # Validate corrupt images in the target directory
-    validate_corrupt_images(dir1, corrupt_report)
-
-    # Only create error folders if there are errors
-    if filename_error_report:
-        filename_error_dir = os.path.join(dir1, 'filename_errors')
-        os.makedirs(filename_error_dir, exist_ok=True)  # Create the filename error directory
-
-    # Save filename error report to CSV if there are any errors
-    if filename_error_report:
-        filename_error_df = pd.DataFrame(filename_error_report)
-        filename_error_df.to_csv(os.path.join(filename_error_dir, 'filename_error_report.csv'), index=False)
-
-    # Save corrupt file report to CSV if there are any corrupted files
-    if corrupt_report:
-        corrupt_report_df = pd.DataFrame(corrupt_report)
-        corrupt_report_df.to_csv(os.path.join(dir1, 'corrupt_files', 'corrupt_file_report.csv'), index=False)
-
-    # Add summary information
-    with open('comparison_report.csv', 'a') as f:
-        f.write(f'\n\nDirectories are identical: {identical}\n')
+    # Copy unmatched files from dir1 to the Alliance directory
+    copy_unmatched_files(unmatched_files, dir1, dir1, md5_error_report, engine, snapshot1, snapshot1,
+                         copy_manifest, args.sha256)
 
-    if df.empty:
+    # Copy unmatched files from dir2 to the Alliance directory and re-run the comparison
+    # Images only: the vendor's checksum manifest and other sidecar files stay in Picturae
+    unmatched_files_dir2 = [f for f in snapshot2.files(is_valid_file_type)
+                            if f not in snapshot1 and (only is None or f in only)]
+    copy_unmatched_files(unmatched_files_dir2, dir2, dir1, md5_error_report, engine, snapshot2, snapshot1,
+                         copy_manifest, args.sha256, manifest)
+    copy_manifest.close()
+
+    # Re-run comparison to include unmatched files in dir2, streaming each row to the comparison report
+    with ReportWriter('comparison_report.csv', COMPARISON_FIELDS) as report:
+        _, identical, _ = compare_directories(dir1, dir2, engine, qc_report.tee(report), only, snapshot1, snapshot2,
+                                              args.trust_level, manifest)
+    md5_error_report.close()
+    cache.save()
+    print(cache.stats())
+    print(engine.report())
+    for mismatch in cache.mismatches:
+        print(f"[HASH CHANGED] {mismatch['Filename']}: {mismatch['Cached MD5']} -> {mismatch['MD5']}")
+
+    # Check JPG/DNG pairs before invalid filenames are moved out of the Alliance directory
+    pairing_issues = check_file_pairs(snapshot1, qc_report, only)
+
+    # Validate filenames and corrupt images in the Alliance directory. Both only plan their moves; the snapshot
+    # already reflects them, and they are carried out together in one journaled batch.
+    mover = MovePlan(journal_path_for(dir1))
+    validate_filenames(dir1, filename_error_report, only, snapshot1, mover)
+    filename_error_report.close()
+    validate_corrupt_images(dir1, corrupt_report, args.deep_check, only, snapshot1, mover)
+    print(f"Moving {len(mover)} files to the error folders")
+    mover.execute()
+
+    # Record what this run processed so the next incremental run starts from here
+    watermark.mark_seen(dir1, scan_dir1, only)
+    watermark.mark_seen(dir2, scan_dir2, only)
+    watermark.save()
+    corrupt_report.close()
+    qc_report.save('qc_report.csv')
+
+    # Summary information goes to a sidecar file so the comparison CSV stays machine readable
+    write_summary('comparison_report.csv', {
+        'Mode': args.mode,
+        'Trust level': args.trust_level,
+        'Checksum manifest': manifest_path,
+        'Directories are identical': identical,
+        'Files compared': len(report),
+        'MD5 errors': len(md5_error_report),
+        'Filename errors': len(filename_error_report),
+        'Corrupt files': len(corrupt_report),
+        'Files copied': len(copy_manifest),
+        'Pairing issues': pairing_issues,
+        'Files in combined report': len(qc_report),
+    })
+
+    if not report:
         print("The report is empty. No matching files found.")
     else:
         print('Comparison report saved to comparison_report.csv')
+        print('Combined report saved to qc_report.csv')
+
+    if copy_manifest:
+        print('Copied files recorded in copy_manifest.csv')
 
     if md5_error_report:
         print('MD5 error report saved to md5_errors/md5_error_report.csv')
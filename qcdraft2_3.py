@@ -16,11 +16,23 @@
 
 import os
 import re
-import cv2
 import hashlib
-import shutil
-import numpy as np
-import pandas as pd
+import argparse
+import functools
+from hash_cache import HashCache
+from qc_engine import run_qc, DEFAULT_WORKERS
+from qc_metrics import analyse_image, load_thresholds, REDUCED_DECODE_FLAGS
+import grey_card
+import focus_map
+from grey_card import GreyCardSession
+from image_structure import check_corruption
+from report_writer import ReportWriter, write_summary
+from file_mover import MovePlan, journal_path_for, recover_pending
+from qc_pipeline import QCPipeline
+
+# Fixed report columns, so rows can be streamed to CSV as each file finishes
+REPORT_FIELDS = ['Filename', 'Valid Filename', 'Corrupted', 'White Balanced', 'In Focus']
+COMPARISON_FIELDS = ['Filename', 'MD5 Match', 'Not Found In']
 
 def is_valid_file_type(filename):
     return filename.lower().endswith(('.jpg', '.jpeg', '.dng', '.cr2', '.tif', '.tiff'))
@@ -29,22 +41,26 @@ def is_valid_filename(filename):
     pattern = r'^(V\d{7}F|C\d{7}F)\.(jpg|jpeg|dng|cr2|tif|tiff)$'
     return re.match(pattern, filename, re.IGNORECASE) is not None
 
-def is_image_corrupted(file_path):
-    image = cv2.imread(file_path)
-    return image is None
+def is_image_corrupted(file_path, deep=False):
+    # Structural check of the file; deep also fully decodes the image
+    return check_corruption(file_path, deep) is not None
 
-def get_md5_hash(file_path):
+def get_md5_hash(file_path, cache=None):
+    if cache is not None:
+        return cache.get_md5(file_path, get_md5_hash)
     hash_md5 = hashlib.md5()
     with open(file_path, 'rb') as f:
         for chunk in iter(lambda: f.read(4096), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-def compare_directories(dir1, dir2):
-    report = []
+# Rows are appended to report as they are produced; pass a ReportWriter to stream them to disk
+def compare_directories(dir1, dir2, cache=None, report=None):
+    if report is None:
+        report = []
     identical = True
-    dir1_files = {f: get_md5_hash(os.path.join(dir1, f)) for f in os.listdir(dir1) if is_valid_file_type(f)}
-    dir2_files = {f: get_md5_hash(os.path.join(dir2, f)) for f in os.listdir(dir2) if is_valid_file_type(f)}
+    dir1_files = {f: get_md5_hash(os.path.join(dir1, f), cache) for f in os.listdir(dir1) if is_valid_file_type(f)}
+    dir2_files = {f: get_md5_hash(os.path.join(dir2, f), cache) for f in os.listdir(dir2) if is_valid_file_type(f)}
 
     for filename in dir1_files:
         if filename in dir2_files:
@@ -63,70 +79,121 @@ def compare_directories(dir1, dir2):
 
     return report, identical
 
-def validate_and_report_issues(target_dir, report):
+# Moves into the errors folder are added to mover, or made at the end if no MovePlan is given
+def validate_and_report_issues(target_dir, report, deep=False, mover=None):
     errors_dir = os.path.join(target_dir, 'errors')
-    if not os.path.exists(errors_dir):
-        os.makedirs(errors_dir)
+    own_plan = mover is None
+    if own_plan:
+        mover = MovePlan(journal_path_for(target_dir))
 
     for filename in os.listdir(target_dir):
         if is_valid_file_type(filename):
             file_path = os.path.join(target_dir, filename)
             valid_filename = is_valid_filename(filename)
-            corrupted = is_image_corrupted(file_path)
+            corrupted = is_image_corrupted(file_path, deep)
 
             if corrupted:
                 report.append({'Filename': filename, 'Valid Filename': valid_filename, 'Corrupted': True, 'White Balanced': None, 'In Focus': None})
-                shutil.move(file_path, os.path.join(errors_dir, filename))
+                mover.add(file_path, os.path.join(errors_dir, filename))
             elif not valid_filename:
                 report.append({'Filename': filename, 'Valid Filename': False, 'Corrupted': False, 'White Balanced': None, 'In Focus': None})
-                shutil.move(file_path, os.path.join(errors_dir, filename))
+                mover.add(file_path, os.path.join(errors_dir, filename))
             else:
                 report.append({'Filename': filename, 'Valid Filename': True, 'Corrupted': False, 'White Balanced': None, 'In Focus': None})
 
-def check_white_balance(image):
-    img_float = image.astype(np.float32) / 255.0
-    means = img_float.mean(axis=(0, 1))  # Calculate mean of RGB channels
-    return means
-
-def is_white_balanced(means, threshold=0.1):
-    return abs(means[0] - means[1]) < threshold and abs(means[1] - means[2]) < threshold
-
-def check_focus(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    focus_measure = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return focus_measure
-
-def is_in_focus(focus_measure, focus_threshold=100.0):
-    return focus_measure > focus_threshold
-
-def process_images(folder_path, report):
-    for entry in report:
-        filename = entry['Filename']
-        if entry['Valid Filename'] and not entry['Corrupted']:
-            file_path = os.path.join(folder_path, filename)
-            image = cv2.imread(file_path)
-
-            if image is None:
-                continue  # This case should have been handled already
-
-            # Check white balance
-            white_balance = check_white_balance(image)
-            white_balanced = is_white_balanced(white_balance)
-
-            # Check focus
-            focus = check_focus(image)
-            in_focus = is_in_focus(focus)
+    if own_plan:
+        mover.execute()
+
+# Finished entries are appended to output if given: files that skip the image checks straight away,
+# the others as soon as their checks complete
+# Moves of files failing the checks are added to mover, or made at the end if no MovePlan is given
+# grey_card_key (station/session) measures white balance on the grey card, located once per session
+# focus_tiles turns on the tiled focus check (see qc_metrics.analyse_decoded), heatmaps go to folder_path/focus_maps
+def process_images(folder_path, report, workers=DEFAULT_WORKERS, scale=1, output=None, mover=None,
+                   grey_card_key=None, focus_tiles=None, focus_early_exit=False, heatmaps=False):
+    own_plan = mover is None
+    if own_plan:
+        mover = MovePlan(journal_path_for(folder_path))
+    entries = [entry for entry in report if entry['Valid Filename'] and not entry['Corrupted']]
+    file_paths = [os.path.join(folder_path, entry['Filename']) for entry in entries]
+    if output is not None:
+        for entry in report:
+            if not entry['Valid Filename'] or entry['Corrupted']:
+                output.append(entry)
+
+    # Metrics on reduced resolution decodes are judged against thresholds calibrated for that scale
+    focus_threshold, wb_threshold = load_thresholds(scale)
+    session = GreyCardSession(grey_card_key, file_paths) if grey_card_key is not None else None
+    heatmap_dir = focus_map.make_heatmap_dir(folder_path) if heatmaps else None
+    analyse = functools.partial(analyse_image, scale=scale, focus_threshold=focus_threshold, wb_threshold=wb_threshold,
+                                grey_card=session.roi if session else None, focus_tiles=focus_tiles,
+                                focus_early_exit=focus_early_exit, heatmap_dir=heatmap_dir)
+
+    # White balance and focus checks run on a process pool; results come back in report order
+    for entry, (file_path, analysis) in zip(entries, run_qc(file_paths, workers, func=analyse)):
+        if analysis is not None:  # Unreadable files should have been handled already
+            white_balanced = analysis['White Balanced']
+            in_focus = analysis['In Focus']
 
             # Update report with white balance and focus checks
             entry['White Balanced'] = white_balanced
             entry['In Focus'] = in_focus
 
+            # A card only found further into the batch, or found again after it moved, is cached for the session
+            if session is not None:
+                session.update(analysis['Grey Card ROI'])
+
             if not in_focus or not white_balanced:
-                shutil.move(file_path, os.path.join(folder_path, 'errors', filename))
+                mover.add(file_path, os.path.join(folder_path, 'errors', entry['Filename']))
+
+        if output is not None:
+            output.append(entry)
+
+    if own_plan:
+        mover.execute()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the Alliance and Picturae directories and QC the Alliance copy.")
+    parser.add_argument('--alliance', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance")
+    parser.add_argument('--picturae', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of QC worker processes")
+    parser.add_argument('--scale', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=1,
+                        help="Decode images at 1/scale resolution for the QC metrics")
+    parser.add_argument('--deep-check', action='store_true',
+                        help="Fully decode images when checking for corruption, not just their file structure")
+    grey_card.add_arguments(parser, station_default="the Alliance folder name")
+    focus_map.add_arguments(parser)
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Run the comparison and all checks as one overlapping pipeline instead of one after the other")
+    return parser.parse_args()
+
+# Comparison and checks in one pass per file with the stages overlapping (see qc_pipeline)
+def run_pipeline(args, dir1, dir2, cache, mover):
+    focus_tiles, focus_early_exit, heatmaps = focus_map.options_from_args(args)
+    options = {'focus_tiles': focus_tiles, 'focus_early_exit': focus_early_exit}
+    session = None
+    if args.grey_card:
+        file_paths = [os.path.join(dir1, f) for f in sorted(os.listdir(dir1))
+                      if is_valid_file_type(f) and is_valid_filename(f)]
+        session = GreyCardSession(grey_card.key_from_args(args, dir1), file_paths)
+        options['grey_card'] = session.roi
+    if heatmaps:
+        options['heatmap_dir'] = focus_map.make_heatmap_dir(dir1)
+
+    with ReportWriter('comparison_report.csv', COMPARISON_FIELDS) as comparison_report, \
+            ReportWriter(os.path.join(dir1, 'errors', 'error_report.csv'), REPORT_FIELDS, lazy=True) as error_report:
+        pipeline = QCPipeline(dir1, dir2, comparison_report, error_report, mover, cache, args.workers,
+                              scale=args.scale, deep=args.deep_check, analysis_options=options)
+        identical = pipeline.run()
+    print(pipeline.stats())
+    if session is not None:
+        session.update(pipeline.grey_card_roi)
+    return identical, comparison_report, error_report
 
 def main():
-    dir1 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance"
-    dir2 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae"
+    args = parse_args()
+    dir1 = args.alliance
+    dir2 = args.picturae
 
     if not os.path.exists(dir1):
         print(f"Directory 1 does not exist: {dir1}")
@@ -135,28 +202,52 @@ def main():
         print(f"Directory 2 does not exist: {dir2}")
         return
 
-    report = []
-
-    # First comparison
-    comparison_report, identical = compare_directories(dir1, dir2)
-
-    # Validate filenames and check for image corruption
-    validate_and_report_issues(dir1, report)
+    # Finish any moves an interrupted run left half done before looking at the directory
+    recover_pending(dir1)
 
-    # Process images for white balance and focus checks
-    process_images(dir1, report)
-
-    # Combine all reports into a single report
-    if report:
-        report_df = pd.DataFrame(report)
-        report_df.to_csv(os.path.join(dir1, 'errors', 'error_report.csv'), index=False)
-
-    # Save the comparison report
-    comparison_df = pd.DataFrame(comparison_report)
-    comparison_df.to_csv('comparison_report.csv', index=False)
+    report = []
+    cache = HashCache()  # Hashes of unchanged files are reused between runs
+
+    if args.pipeline:
+        mover = MovePlan(journal_path_for(dir1))
+        identical, comparison_report, error_report = run_pipeline(args, dir1, dir2, cache, mover)
+        cache.save()
+        mover.execute()
+        write_summary('comparison_report.csv', {
+            'Directories are identical': identical,
+            'Comparison rows': len(comparison_report),
+            'Files checked': len(error_report),
+        })
+        print('Reports generated.')
+        return
 
-    with open('comparison_report.csv', 'a') as f:
-        f.write(f'\n\nDirectories are identical: {identical}\n')
+    # First comparison, streamed to the comparison report
+    with ReportWriter('comparison_report.csv', COMPARISON_FIELDS) as comparison_report:
+        _, identical = compare_directories(dir1, dir2, cache, comparison_report)
+    cache.save()
+    print(cache.stats())
+
+    # Validate filenames and check for image corruption. Files failing any check are moved to errors/ in one
+    # journaled batch once the image checks have finished; the folder is only created if something goes into it.
+    mover = MovePlan(journal_path_for(dir1))
+    validate_and_report_issues(dir1, report, args.deep_check, mover)
+
+    # Report rows in filename order so output does not depend on the directory listing
+    report.sort(key=lambda entry: entry['Filename'])
+
+    # Process images for white balance and focus checks, streaming every finished row into a single report
+    with ReportWriter(os.path.join(dir1, 'errors', 'error_report.csv'), REPORT_FIELDS, lazy=True) as error_report:
+        focus_tiles, focus_early_exit, heatmaps = focus_map.options_from_args(args)
+        process_images(dir1, report, args.workers, args.scale, error_report, mover,
+                       grey_card.key_from_args(args, dir1), focus_tiles, focus_early_exit, heatmaps)
+    mover.execute()
+
+    # Summary information goes to a sidecar file so the comparison CSV stays machine readable
+    write_summary('comparison_report.csv', {
+        'Directories are identical': identical,
+        'Comparison rows': len(comparison_report),
+        'Files checked': len(error_report),
+    })
 
     print('Reports generated.')
 
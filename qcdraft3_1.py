@@ -1,9 +1,22 @@
 import os
 import re
-import cv2
-import hashlib
-import numpy as np
-import pandas as pd
+import argparse
+from hash_cache import HashCache
+from hash_engine import HashEngine, hash_file
+from image_pipeline import read_and_hash, decode_image
+from image_structure import check_structure_bytes, DECODABLE_EXTENSIONS
+from raw_preview import is_raw_file
+from qc_metrics import (analyse_decoded, load_thresholds, REDUCED_DECODE_FLAGS, DEFAULT_FOCUS_THRESHOLD,
+                        DEFAULT_WB_THRESHOLD)
+from report_writer import ReportWriter, write_summary
+from qc_report import QCReport
+from checksum_manifest import ChecksumManifest, find_manifest
+from file_pairing import check_pairs
+from phash_index import PerceptualIndex, dhash, near_duplicates, DEFAULT_INDEX_PATH, DEFAULT_MAX_DISTANCE
+
+# Fixed report columns, so rows can be streamed to CSV as each file finishes
+ANALYSIS_FIELDS = ['Filename', 'Valid Filename', 'Uncorrupted', 'White Balanced', 'In Focus', 'MD5 Match']
+COMPARISON_FIELDS = ['Filename', 'MD5 Match', 'Not Found In']  # The checks are in the analysis and QC reports
 
 # Function to validate file type (images)
 def is_valid_file_type(filename):
@@ -14,25 +27,34 @@ def is_valid_filename(filename):
     pattern = r'^(V\d{7}F|C\d{7}F)\.(jpg|jpeg|dng|cr2|tif|tiff)$'
     return re.match(pattern, filename, re.IGNORECASE) is not None
 
-# Function to check if the image is corrupted
-def is_image_corrupted(file_path):
-    image = cv2.imread(file_path)
-    return image is None
-
-# Function to compute MD5 hash of a file
-def get_md5_hash(file_path):
-    hash_md5 = hashlib.md5()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+# Function to compute MD5 hash of a file, through the hashing engine if one is given
+def get_md5_hash(file_path, engine=None):
+    if engine is not None:
+        return engine.md5(file_path)
+    return hash_file(file_path)
+
+# Function to compute the MD5 hash of every image in a directory, returned as {filename: hash}
+# known holds hashes that have already been computed, so those files are not read again
+def hash_directory(directory, engine=None, known=None):
+    if engine is None:
+        engine = HashEngine()
+    if known is None:
+        known = {}
+    paths = {f: os.path.join(directory, f) for f in os.listdir(directory) if is_valid_file_type(f) and f not in known}
+    hashes = engine.md5_many(list(paths.values()))
+    files = {f: hashes[path] for f, path in paths.items()}
+    files.update(known)
+    return files
 
 # Function to compare files in two directories
-def compare_directories(dir1, dir2):
-    comparison_report = []
+# dir1_hashes/dir2_hashes hold MD5s already computed for either side, so those files are not read again
+# Rows are appended to comparison_report as they are produced, one per file; pass a ReportWriter to stream them to disk
+def compare_directories(dir1, dir2, engine=None, dir1_hashes=None, dir2_hashes=None, comparison_report=None):
+    if comparison_report is None:
+        comparison_report = []
     identical = True
-    dir1_files = {f: get_md5_hash(os.path.join(dir1, f)) for f in os.listdir(dir1) if is_valid_file_type(f)}
-    dir2_files = {f: get_md5_hash(os.path.join(dir2, f)) for f in os.listdir(dir2) if is_valid_file_type(f)}
+    dir1_files = hash_directory(dir1, engine, dir1_hashes)
+    dir2_files = hash_directory(dir2, engine, dir2_hashes)
 
     # Compare files in dir1 against dir2
     for filename in dir1_files:
@@ -51,105 +73,86 @@ def compare_directories(dir1, dir2):
             identical = False
             comparison_report.append({'Filename': filename, 'MD5 Match': False, 'Not Found In': 'Alliance'})
 
-    # Add missing files to the combined report with a note
-    for filename in dir1_files:
-        if filename not in dir2_files:
-            comparison_report.append({
-                'Filename': filename,
-                'MD5 Match': False,
-                'Not Found In': 'Picturae',
-                'White Balanced': None,
-                'In Focus': None,
-                'Uncorrupted': None,
-                'Valid Filename': None
-            })
-
-    for filename in dir2_files:
-        if filename not in dir1_files:
-            comparison_report.append({
-                'Filename': filename,
-                'MD5 Match': False,
-                'Not Found In': 'Alliance',
-                'White Balanced': None,
-                'In Focus': None,
-                'Uncorrupted': None,
-                'Valid Filename': None
-            })
-
     return comparison_report, identical
 
-# Function to validate files (check if valid filename and if file is corrupted)
-def validate_files(target_dir, report):
+# Function to validate files (check if valid filename and if file is corrupted) and run the image checks
+# Each file is read once: the same bytes give the MD5 hash, the structural corruption check and the decoded image
+# scale decodes the image at 1/2, 1/4 or 1/8 resolution for the checks, judged against calibrated thresholds
+# reference_hashes ({filename: hash} of the Picturae copies) fills in 'MD5 Match' as each file is read
+# Entries are appended to report once complete; pass a ReportWriter to stream them to disk
+# phashes, if given, collects {filename: dHash} from the same decode for the near duplicate check
+def validate_files(target_dir, report, cache=None, scale=1, reference_hashes=None, phashes=None):
+    hashes = {}
+    focus_threshold, wb_threshold = load_thresholds(scale)
     for filename in os.listdir(target_dir):
         if is_valid_file_type(filename):
             file_path = os.path.join(target_dir, filename)
             valid_filename = is_valid_filename(filename)
-            corrupted = is_image_corrupted(file_path)
+            data, md5_hash = read_and_hash(file_path, cache)
+            hashes[filename] = md5_hash
+
+            # Corrupt if the file structure is broken, or if a format OpenCV supports fails to decode.
+            # Raw DNG/CR2 files are checked on their embedded JPEG preview and are not counted as corrupt
+            # if they have none.
+            corrupted = check_structure_bytes(data) is not None
+            image = None if corrupted else decode_image(data, REDUCED_DECODE_FLAGS[scale], is_raw_file(filename))
+            if image is None and filename.lower().endswith(DECODABLE_EXTENSIONS):
+                corrupted = True
+            del data
 
             # Always add the 'Uncorrupted' key, and ensure all other relevant keys are included
-            report.append({
+            entry = {
                 'Filename': filename,
                 'Valid Filename': valid_filename,
                 'Uncorrupted': not corrupted,  # Reverse the value: True if not corrupted, False if corrupted
                 'White Balanced': None,  # Placeholder for white balance
                 'In Focus': None,        # Placeholder for focus
-            })
-
-# Function to check white balance of an image
-def check_white_balance(image):
-    img_float = image.astype(np.float32) / 255.0
-    means = img_float.mean(axis=(0, 1))  # Calculate mean of RGB channels
-    return means
-
-# Function to check if the white balance is within a threshold
-def is_white_balanced(means, threshold=0.1):
-    return abs(means[0] - means[1]) < threshold and abs(means[1] - means[2]) < threshold
-
-# Function to check focus of an image using Laplacian
-def check_focus(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    focus_measure = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return focus_measure
-
-# Function to check if the image is in focus
-def is_in_focus(focus_measure, focus_threshold=100.0):
-    return focus_measure > focus_threshold
-
-# Function to process images and add results to the report
-def process_images(folder_path, report):
-    for entry in report:
-        filename = entry['Filename']
-        if is_valid_file_type(filename):
-            file_path = os.path.join(folder_path, filename)
-            image = cv2.imread(file_path)
-
-            # Ensure the 'Uncorrupted' key exists
-            if 'Uncorrupted' not in entry:
-                print(f"Warning: 'Uncorrupted' key is missing for {filename}. Skipping file.")
-                continue  # Skip if 'Uncorrupted' key is missing
-
-            # Check if the image is uncorrupted
-            if not entry['Uncorrupted']:  # We now check for Uncorrupted, which is True if the image is not corrupted
-                entry['White Balanced'] = "Unable to open file"
-                entry['In Focus'] = "Unable to open file"
-                continue  # Skip further checks for this image
-
-            # Check white balance
-            white_balance = check_white_balance(image)
-            white_balanced = is_white_balanced(white_balance)
-
-            # Check focus
-            focus = check_focus(image)
-            in_focus = is_in_focus(focus)
-
-            # Update report with white balance and focus checks
-            entry['White Balanced'] = white_balanced
-            entry['In Focus'] = in_focus
+            }
+            process_image(entry, image, focus_threshold, wb_threshold)
+            if phashes is not None and image is not None:
+                phashes[filename] = dhash(image)
+            if reference_hashes is not None:
+                entry['MD5 Match'] = reference_hashes.get(filename) == md5_hash
+            report.append(entry)
+    return hashes
+
+# Function to run the white balance and focus checks on an already decoded image and add results to the report entry
+def process_image(entry, image, focus_threshold=DEFAULT_FOCUS_THRESHOLD, wb_threshold=DEFAULT_WB_THRESHOLD):
+    # Check if the image is uncorrupted
+    if image is None:
+        entry['White Balanced'] = "Unable to open file"
+        entry['In Focus'] = "Unable to open file"
+        return  # Skip further checks for this image
+
+    # White balance and focus in one pass over the decoded image (see qc_metrics.measure_image)
+    analysis = analyse_decoded(image, focus_threshold=focus_threshold, wb_threshold=wb_threshold)
+
+    # Update report with white balance and focus checks
+    entry['White Balanced'] = analysis['White Balanced']
+    entry['In Focus'] = analysis['In Focus']
+
+# Command line options; directories default to the test folders
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare the Alliance and Picturae directories and QC the Alliance copy.")
+    parser.add_argument('--alliance', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance")
+    parser.add_argument('--picturae', default=r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae")
+    parser.add_argument('--scale', type=int, choices=sorted(REDUCED_DECODE_FLAGS), default=1,
+                        help="Decode images at 1/scale resolution for the QC metrics")
+    parser.add_argument('--manifest', help="Picturae checksum manifest (CSV, JSON or BagIt manifest-md5.txt) used "
+                                           "instead of hashing the Picturae copies. Defaults to a manifest found in "
+                                           "the Picturae directory")
+    parser.add_argument('--find-duplicates', action='store_true',
+                        help="Check every image against the perceptual hash index of the whole collection")
+    parser.add_argument('--phash-index', default=DEFAULT_INDEX_PATH, help="Perceptual hash index database")
+    parser.add_argument('--max-distance', type=int, default=DEFAULT_MAX_DISTANCE,
+                        help="Largest number of differing hash bits counted as a near duplicate")
+    return parser.parse_args()
 
 # Main function
 def main():
-    dir1 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Alliance"
-    dir2 = r"C:\Users\Danie\Pictures\For Work\pytests\test2\Picturae"
+    args = parse_args()
+    dir1 = args.alliance
+    dir2 = args.picturae
 
     if not os.path.exists(dir1):
         print(f"Directory 1 does not exist: {dir1}")
@@ -158,34 +161,65 @@ def main():
         print(f"Directory 2 does not exist: {dir2}")
         return
 
-    report = []
-
-    # Compare directories first
-    comparison_report, identical = compare_directories(dir1, dir2)
-
-    # Validate filenames and check for image corruption
-    validate_files(dir1, report)
-
-    # Process images for white balance and focus checks
-    process_images(dir1, report)
-
-    # Add comparison results to the report
-    for entry in report:
-        filename = entry['Filename']
-        comparison_entry = next((comp for comp in comparison_report if comp['Filename'] == filename), None)
-        if comparison_entry:
-            entry['MD5 Match'] = comparison_entry.get('MD5 Match', None)
-
-    # Save the combined report as a CSV directly in dir1
-    report_df = pd.DataFrame(report)
-    report_df.to_csv(os.path.join(dir1, 'analysis_report.csv'), index=False)
-
-    # Save the comparison report separately if needed
-    comparison_df = pd.DataFrame(comparison_report)
-    comparison_df.to_csv('comparison_report.csv', index=False)
-
-    with open('comparison_report.csv', 'a') as f:
-        f.write(f'\n\nDirectories are identical: {identical}\n')
+    cache = HashCache()  # Hashes of unchanged files are reused between runs
+    engine = HashEngine(cache)
+
+    # Hash the Picturae copies first so each Alliance file can be matched as soon as it has been read.
+    # Files listed in a vendor manifest take its checksum and are not read.
+    manifest_path = args.manifest or find_manifest(dir2)
+    known = None
+    if manifest_path:
+        manifest = ChecksumManifest(manifest_path)
+        known = manifest.known_for(os.listdir(dir2))
+        print(f"Using {len(known)} checksums from {manifest_path}")
+    dir2_hashes = hash_directory(dir2, engine, known)
+
+    # Every stage's rows are also merged into one row per file, keyed by filename
+    qc_report = QCReport(ANALYSIS_FIELDS + ['Not Found In', 'Pairing'] +
+                         (['Near Duplicates'] if args.find_duplicates else []))
+    phashes = {} if args.find_duplicates else None
+
+    # Validate filenames, check for image corruption and run white balance and focus checks in one read per file.
+    # The analysis report is written directly in dir1, one row as each file finishes.
+    with ReportWriter(os.path.join(dir1, 'analysis_report.csv'), ANALYSIS_FIELDS) as report:
+        dir1_hashes = validate_files(dir1, qc_report.tee(report), cache, args.scale, dir2_hashes, phashes)
+
+    # Compare directories, reusing the hashes computed for both sides, and save the comparison report separately
+    with ReportWriter('comparison_report.csv', COMPARISON_FIELDS) as comparison_report:
+        _, identical = compare_directories(dir1, dir2, engine, dir1_hashes, dir2_hashes,
+                                           qc_report.tee(comparison_report))
+
+    # Check every Alliance barcode has its JPG and DNG, from the names already read
+    pairing_issues = check_pairs(dir1_hashes)
+    for filename, issue in pairing_issues.items():
+        qc_report.merge(filename, {'Pairing': issue})
+
+    # Look for images that match ones already in the collection, then add this batch to the index
+    duplicates = 0
+    if phashes is not None:
+        with PerceptualIndex(args.phash_index) as index:
+            for filename, phash in phashes.items():
+                matches = near_duplicates(index, filename, phash, args.max_distance)
+                if matches:
+                    qc_report.merge(filename, {'Near Duplicates': matches})
+                    duplicates += 1
+                index.add(filename, phash, os.path.join(dir1, filename))
+
+    # Combined report: the analysis of every Alliance file plus the files missing from either side
+    qc_report.save(os.path.join(dir1, 'qc_report.csv'))
+    cache.save()
+    print(cache.stats())
+    print(engine.report())
+
+    # Summary information goes to a sidecar file so the comparison CSV stays machine readable
+    write_summary('comparison_report.csv', {
+        'Directories are identical': identical,
+        'Files analysed': len(report),
+        'Comparison rows': len(comparison_report),
+        'Files in combined report': len(qc_report),
+        'Pairing issues': len(pairing_issues),
+        'Files with near duplicates': duplicates,
+    })
 
     print('Reports generated.')
 
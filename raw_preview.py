@@ -0,0 +1,87 @@
+### Raw DNG/CR2 handling through the embedded JPEG previews.
+### Both formats are TIFF based and carry full or near full size JPEG previews next to the raw data. The IFDs are
+### parsed to find them and the largest one that decodes is used for the pixel QC, which avoids a full demosaic.
+
+import io
+import struct
+import cv2
+import numpy as np
+from image_structure import (iter_tiff_ifds, read_tiff_values, TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS,
+                             TIFF_JPEG_OFFSET, TIFF_JPEG_LENGTH)
+
+RAW_EXTENSIONS = ('.dng', '.cr2')
+
+TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH = 256, 257
+TIFF_COMPRESSION, TIFF_PHOTOMETRIC = 259, 262
+COMPRESSION_OLD_JPEG, COMPRESSION_JPEG = 6, 7
+PHOTOMETRIC_CFA, PHOTOMETRIC_LINEAR_RAW = 32803, 34892
+CR2_SLICES = 50752  # Only present on the CR2 raw IFD, which is lossless JPEG that OpenCV cannot decode
+
+def _value(f, endian, size, tags, tag):
+    if tag not in tags:
+        return None
+    values = read_tiff_values(f, endian, size, tags[tag])
+    return values[0] if values else None
+
+def find_jpeg_previews(f, size):
+    """Return (offset, length, pixels) for every embedded JPEG preview, largest first."""
+    previews = []
+    for endian, tags in iter_tiff_ifds(f, size):
+        width = _value(f, endian, size, tags, TIFF_IMAGE_WIDTH) or 0
+        height = _value(f, endian, size, tags, TIFF_IMAGE_LENGTH) or 0
+
+        # Thumbnail style previews (CR2 IFD1, EXIF thumbnails)
+        offset = _value(f, endian, size, tags, TIFF_JPEG_OFFSET)
+        length = _value(f, endian, size, tags, TIFF_JPEG_LENGTH)
+        if offset and length:
+            previews.append((offset, length, width * height))
+
+        # Single strip JPEG images that are not the raw data itself (DNG preview SubIFDs, CR2 IFD0)
+        compression = _value(f, endian, size, tags, TIFF_COMPRESSION)
+        photometric = _value(f, endian, size, tags, TIFF_PHOTOMETRIC)
+        if (compression in (COMPRESSION_OLD_JPEG, COMPRESSION_JPEG) and CR2_SLICES not in tags
+                and photometric not in (PHOTOMETRIC_CFA, PHOTOMETRIC_LINEAR_RAW)
+                and TIFF_STRIP_OFFSETS in tags and TIFF_STRIP_BYTE_COUNTS in tags):
+            offsets = read_tiff_values(f, endian, size, tags[TIFF_STRIP_OFFSETS]) or ()
+            lengths = read_tiff_values(f, endian, size, tags[TIFF_STRIP_BYTE_COUNTS]) or ()
+            if len(offsets) == 1 and len(lengths) == 1:
+                previews.append((offsets[0], lengths[0], width * height))
+
+    previews = [p for p in dict.fromkeys(previews) if p[0] + p[1] <= size]
+    return sorted(previews, key=lambda p: (p[2], p[1]), reverse=True)
+
+def decode_raw_preview(data, flags=cv2.IMREAD_COLOR):
+    """Decode the largest usable embedded JPEG preview of an in-memory DNG/CR2, or None if there is none."""
+    try:
+        previews = find_jpeg_previews(io.BytesIO(data), len(data))
+    except (ValueError, struct.error):
+        return None
+    for offset, length, _ in previews:
+        if data[offset:offset + 2] != b'\xFF\xD8':
+            continue
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8, count=length, offset=offset), flags)
+        if image is not None:
+            return image
+    return None
+
+def read_raw_preview(file_path, flags=cv2.IMREAD_COLOR):
+    """Read only the largest usable embedded JPEG preview of a DNG/CR2 file and decode it."""
+    with open(file_path, 'rb') as f:
+        size = f.seek(0, io.SEEK_END)
+        try:
+            previews = find_jpeg_previews(f, size)
+        except (ValueError, struct.error):
+            return None
+        for offset, length, _ in previews:
+            f.seek(offset)
+            jpeg = f.read(length)
+            if jpeg[:2] != b'\xFF\xD8':
+                continue
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flags)
+            if image is not None:
+                return image
+    return None
+
+def is_raw_file(filename):
+    """Check if the file is a raw format handled through its embedded preview."""
+    return filename.lower().endswith(RAW_EXTENSIONS)
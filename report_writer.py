@@ -0,0 +1,85 @@
+### Streaming CSV reports.
+### Rows are appended as each file finishes instead of building a DataFrame at the end of the run, so a crash keeps
+### everything written so far. The schema is fixed when the report is opened, and run summaries go to a JSON sidecar
+### so the CSV stays machine readable.
+
+import os
+import csv
+import json
+import time
+
+class ReportWriter:
+    """Append rows to a CSV report with a fixed set of columns, flushing every row and fsyncing periodically.
+
+    Has the same append() as the lists the scripts used to collect rows in, so it can be passed in their place.
+    With lazy=True the file is only created when the first row arrives, for error reports that are usually empty.
+    """
+
+    def __init__(self, path, fieldnames, fsync_every=100, fsync_seconds=5.0, lazy=False):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.fsync_every = fsync_every
+        self.fsync_seconds = fsync_seconds
+        self.rows_written = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.file = None
+        self.writer = None
+        if not lazy:
+            self._open()
+
+    def _open(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)  # Error folders are only created once something goes into them
+        self.file = open(self.path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames, extrasaction='raise')
+        self.writer.writeheader()
+        self.file.flush()
+
+    def __len__(self):
+        return self.rows_written
+
+    def append(self, row):
+        """Write one row. Columns outside the schema raise ValueError; missing columns are left empty."""
+        if self.file is None:
+            self._open()
+        self.writer.writerow(row)
+        self.file.flush()
+        self.rows_written += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        """Force written rows to disk."""
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def summary_path(report_path):
+    """Return the sidecar path for a report, e.g. comparison_report.csv -> comparison_report_summary.json."""
+    return os.path.splitext(report_path)[0] + '_summary.json'
+
+def write_summary(report_path, summary):
+    """Write run summary values next to a report as JSON, atomically replacing any previous summary."""
+    path = summary_path(report_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(summary, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,71 @@
+### Scan watermark for incremental AM/PM runs.
+### Records when each directory was last scanned and the size/mtime of every file seen by that scan, so the next
+### run only processes files that are new or have changed since. shutil.copy2 keeps the source mtime, so a file
+### copied in after the last scan can look old; it is still picked up because it is missing from the seen index.
+
+import os
+import json
+import time
+from dir_snapshot import DirectorySnapshot
+
+DEFAULT_WATERMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scan_watermark.json')
+
+class ScanWatermark:
+    """Per-directory last scan time and {filename: [size, mtime_ns]} index of files already processed."""
+
+    def __init__(self, path=DEFAULT_WATERMARK_PATH):
+        self.path = path
+        self.directories = {}
+        self.started = time.time()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.directories = json.load(f)
+
+    def _state(self, directory):
+        return self.directories.setdefault(os.path.abspath(directory), {'last_scan': None, 'seen': {}})
+
+    def last_scan(self, directory):
+        """Return the time of the last recorded scan of a directory as text, or 'never'."""
+        last_scan = self._state(directory)['last_scan']
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_scan)) if last_scan else 'never'
+
+    def scan(self, directory, file_filter=None):
+        """Return {filename: [size, mtime_ns]} for the files currently in a directory."""
+        return DirectorySnapshot(directory).signatures(file_filter)
+
+    def changed_files(self, directory, signatures):
+        """Return the names from a scan that are new or modified since they were last marked as seen."""
+        seen = self._state(directory)['seen']
+        return [name for name, signature in signatures.items() if seen.get(name) != signature]
+
+    def mark_seen(self, directory, start_scan, names=None):
+        """Record files from the scan taken at the start of the run as processed.
+
+        names limits this to the files the run looked at; None (a full reconcile) rebuilds the whole index.
+        The directory is rescanned so files that were moved out, or changed while the run was going, are not
+        marked as seen and get picked up next time.
+        """
+        current = self.scan(directory)
+        state = self._state(directory)
+        seen = {} if names is None else {name: sig for name, sig in state['seen'].items() if name in current}
+        for name, signature in start_scan.items():
+            if (names is None or name in names) and current.get(name) == signature:
+                seen[name] = signature
+        state['seen'] = seen
+        state['last_scan'] = self.started
+
+    def mark_files_seen(self, directory, signatures):
+        """Record {filename: signature} of files checked one at a time as processed, without rescanning."""
+        self._state(directory)['seen'].update(signatures)
+
+    def forget_missing(self, directory, current):
+        """Drop the files no longer in a fresh scan of the directory from its seen index."""
+        state = self._state(directory)
+        state['seen'] = {name: sig for name, sig in state['seen'].items() if name in current}
+
+    def save(self):
+        """Write the watermark back to disk, atomically replacing the previous file."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.directories, f)
+        os.replace(tmp_path, self.path)
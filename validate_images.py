@@ -1,18 +1,18 @@
 import os
 import re
-import cv2
+import argparse
+from image_structure import check_corruption
 
 def is_valid_filename(filename):
     # Define the regex patterns for the file names
     pattern = r'^(V\d{7}F|C\d{7}F)\.(jpg|jpeg|dng|cr2|tif|tiff)$'
     return re.match(pattern, filename, re.IGNORECASE) is not None
 
-def is_image_corrupted(file_path):
-    # Try to read the image and check if it is valid
-    image = cv2.imread(file_path)
-    return image is None
+def is_image_corrupted(file_path, deep=False):
+    # Structural check of the file, which raw files pass too; deep also fully decodes the image
+    return check_corruption(file_path, deep) is not None
 
-def process_images(folder_path):
+def process_images(folder_path, deep=False):
     valid_files = []
     invalid_files = []
 
@@ -20,7 +20,7 @@ def process_images(folder_path):
         if is_valid_filename(filename):
             file_path = os.path.join(folder_path, filename)
 
-            if is_image_corrupted(file_path):
+            if is_image_corrupted(file_path, deep):
                 invalid_files.append((filename, "Corrupted or unreadable"))
             else:
                 valid_files.append(filename)
@@ -43,5 +43,10 @@ def process_images(folder_path):
         print("No invalid files found.")
 
 if __name__ == "__main__":
-    folder_path = input("Enter the folder path containing images: ")
-    process_images(folder_path)
+    parser = argparse.ArgumentParser(description="List the files in a folder with invalid names or corrupted images.")
+    parser.add_argument('folder_path', nargs='?', help="Folder containing images (prompted for if omitted)")
+    parser.add_argument('--deep-check', action='store_true',
+                        help="Fully decode images when checking for corruption, not just their file structure")
+    args = parser.parse_args()
+    folder_path = args.folder_path or input("Enter the folder path containing images: ")
+    process_images(folder_path, args.deep_check)